@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+'''
+Benchmarks for the day 12 cave paths.
+
+Random cave systems of growing size are generated, with big caves only
+connected to small caves so the number of paths is finite. The number of paths
+of part 1 and part 2 is counted with the depth first search on the compiled
+graph, one path at a time, with the depth first search on the graph with the
+big caves contracted, and with count_paths, one cave state at a time. The depth
+first searches are skipped once they take longer than a second.
+
+The paths are streamed with paths and checked against count_by_length, the
+number of paths by length.
+
+The revisit budget queries are measured the first time and then again from the
+cache, on a new PassageMap with the same passages.
+
+usage: benchmark_passage_pathing.py [number of small caves ...]
+'''
+
+import random
+import sys
+import time
+
+from passage_pathing import PassageMap
+
+
+# The depth first searches are not run again once one takes this long
+DFS_LIMIT = 1.0
+
+
+def random_cave_system(small_caves, seed=12):
+    # Each small cave is connected to a few small caves and big caves, there is
+    # one big cave for each four small caves
+    random.seed(seed)
+    small = ['start', 'end'] + [f"c{i}" for i in range(small_caves)]
+    big = [f"B{i}" for i in range(max(1, small_caves // 4))]
+    edges = set()
+    for cave in small[2:]:
+        for other in random.sample(small, 2):
+            if other != cave:
+                edges.add(tuple(sorted((cave, other))))
+        edges.add((random.choice(big), cave))
+    for cave in big:
+        edges.add((cave, 'start'))
+        edges.add((cave, 'end'))
+
+    passage_map = PassageMap(part_1=True)
+    for start, end in sorted(edges):
+        passage_map.add_node(start, end)
+    return passage_map
+
+
+def depth_first_search(passage_map, part_1):
+    return passage_map.compile().depth_first_search(part_1)
+
+
+def contracted_search(passage_map, part_1):
+    passage_map.reset(part_1)
+    passage_map.depth_first_search_to_end()
+    return passage_map.number_paths_to_end()
+
+
+def benchmark(sizes):
+    run_dfs = True
+    for size in sizes:
+        passage_map = random_cave_system(size)
+        results = []
+        for part_1 in (True, False):
+            start = time.perf_counter()
+            paths = passage_map.count_paths(part_1)
+            counted = time.perf_counter() - start
+            results.append(f"part {1 if part_1 else 2} {paths:>22} paths  "
+                           f"count {counted*1000:8.2f} ms")
+
+            if run_dfs:
+                for name, search in (('dfs', depth_first_search),
+                                     ('contracted dfs', contracted_search)):
+                    start = time.perf_counter()
+                    if search(passage_map, part_1) != paths:
+                        raise Exception(f"count_paths does not match the {name}")
+                    searched = time.perf_counter() - start
+                    results[-1] += f"  {name} {searched*1000:10.2f} ms"
+                    run_dfs = run_dfs and searched < DFS_LIMIT
+
+        print(f"{size:>3} small caves  {passage_map.contract().reduction()}")
+        print("                 " + "\n                 ".join(results))
+
+
+def benchmark_paths(size):
+    passage_map = random_cave_system(size)
+    for part_1 in (True, False):
+        start = time.perf_counter()
+        lengths = {}
+        for path in passage_map.paths(part_1):
+            lengths[len(path)] = lengths.get(len(path), 0) + 1
+        streamed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if passage_map.count_by_length(part_1) != lengths:
+            raise Exception("count_by_length does not match the streamed paths")
+        counted = time.perf_counter() - start
+        print(f"{size} small caves, part {1 if part_1 else 2} {sum(lengths.values()):>10} paths "
+              f"streamed {sum(lengths.values()) / streamed:10.0f} paths/s  "
+              f"count_by_length {counted*1000:8.2f} ms")
+
+
+def benchmark_budgets(size):
+    PassageMap.clear_budget_cache()
+    for revisited_caves, max_visits in ((1, 2), (2, 2), (1, 3), (3, 2), (2, 3)):
+        start = time.perf_counter()
+        paths = random_cave_system(size).count_paths_with_budget(revisited_caves, max_visits)
+        counted = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if random_cave_system(size).count_paths_with_budget(revisited_caves, max_visits) != paths:
+            raise Exception("The cached count does not match")
+        cached = time.perf_counter() - start
+        print(f"{size} small caves, {revisited_caves} caves up to {max_visits} visits "
+              f"{paths:>22} paths  {counted*1000:9.2f} ms  cached {cached*1000:6.2f} ms")
+
+
+if __name__ == '__main__':
+    sizes = [int(size) for size in sys.argv[1:]] or [6, 8, 10, 12, 14]
+    benchmark(sizes)
+    benchmark_paths(sizes[0])
+    benchmark_budgets(sizes[len(sizes) // 2])
@@ -164,9 +164,338 @@ Given these new rules, how many paths through this cave system are there?
 Your puzzle answer was 85062.
 '''
 
-graph_map = {}
+import hashlib
+from collections import OrderedDict
+
+class CompiledPassageMap:
+    # The caves of a PassageMap as small integers, start is 0, end is 1, then
+    # the other small caves and the big caves last. The searches only work with
+    # integers: the passages of each cave are a tuple of ids and the small caves
+    # visited are a bitmask with the bit of each small cave
+    START = 0
+    END = 1
+
+    def __init__(self, passage_map):
+        small = ['start', 'end'] + [cave for cave in passage_map.graph
+                                    if cave.islower() and cave not in ('start', 'end')]
+        big = [cave for cave in passage_map.graph if not cave.islower()]
+        self.names = small + big
+        self.ids = {cave: node for node, cave in enumerate(self.names)}
+        self.small_count = len(small)
+        self.passage_count = sum(len(caves) for caves in passage_map.graph.values()) // 2
+
+        # Same fingerprint for the same passages, whatever the order they were added
+        passages = sorted(f"{cave}-{other}" for cave, caves in passage_map.graph.items()
+                          for other in caves if cave <= other)
+        self.fingerprint = hashlib.sha256('\n'.join(passages).encode()).hexdigest()
+
+        # bit of each cave in the visited bitmask, 0 for the big caves
+        self.bits = [1 << node if node < self.small_count else 0
+                     for node in range(len(self.names))]
+        self.is_small = [node < self.small_count for node in range(len(self.names))]
+
+        # passages of each cave without start and end, with a cave repeated
+        # once for each passage to it, plus the number of passages to end
+        self.passages = []
+        self.end_passages = []
+        for cave in self.names:
+            caves = passage_map.graph.get(cave, [])
+            nodes = [self.ids[other] for other in caves]
+            self.passages.append(tuple(node for node in nodes
+                                       if node not in (CompiledPassageMap.START, CompiledPassageMap.END)))
+            self.end_passages.append(nodes.count(CompiledPassageMap.END))
+
+        # Two connected big caves could be visited back and forth forever
+        for node in range(self.small_count, len(self.names)):
+            for other in self.passages[node]:
+                if not self.is_small[other]:
+                    raise Exception(f"Big caves {self.names[node]} and {self.names[other]} "
+                                    "are connected, there are infinite paths")
+
+        # Number of paths to end from each state of count_paths, and of paths
+        # to end by number of moves from each state of count_by_length
+        self.__path_counts = {}
+        self.__length_counts = {}
+
+    def depth_first_search(self, part_1, node=START, visited=None, travel_twice=None):
+        # Number of paths to end found one by one, from node with the small
+        # caves of visited already in the path
+        if visited is None:
+            visited = self.bits[node]
+        if travel_twice is None:
+            travel_twice = part_1
+
+        # the lists as locals of the closure, without attribute lookups in the loop
+        passages = self.passages
+        end_passages = self.end_passages
+        bits = self.bits
+
+        def search(node, visited, travel_twice):
+            paths = end_passages[node]
+            for cave in passages[node]:
+                bit = bits[cave]
+                if visited & bit:
+                    if not travel_twice:
+                        paths += search(cave, visited, True)
+                else:
+                    paths += search(cave, visited | bit, travel_twice)
+            return paths
+
+        return search(node, visited, travel_twice)
+
+    def count_paths(self, part_1):
+        # Number of paths to end without enumerating them. The paths to end from
+        # a cave only depend on the small caves already visited and on whether a
+        # small cave was visited twice, so the count of each of those states is
+        # computed once. The work grows with the number of states, not of paths.
+        # In part 1 there is no visit twice left since the start
+        return self.__count_from(CompiledPassageMap.START, self.bits[CompiledPassageMap.START],
+                                 int(part_1))
+
+    def __count_from(self, node, visited, travel_twice):
+        # the state (node, visited, travel_twice) packed in a single int
+        state = ((visited * len(self.names) + node) << 1) | travel_twice
+        paths = self.__path_counts.get(state)
+        if paths is not None:
+            return paths
+
+        paths = self.end_passages[node]
+        bits = self.bits
+        for cave in self.passages[node]:
+            bit = bits[cave]
+            if visited & bit:
+                # second visit of a small cave, only once per path
+                if not travel_twice:
+                    paths += self.__count_from(cave, visited, 1)
+            else:
+                paths += self.__count_from(cave, visited | bit, travel_twice)
+
+        self.__path_counts[state] = paths
+        return paths
+
+    def paths(self, part_1):
+        # Paths to end one at a time, as tuples of cave ids from start to end.
+        # The search keeps one iterator of passages for each cave of the current
+        # path, so only the current path is in memory however many there are
+        passages = self.passages
+        end_passages = self.end_passages
+        bits = self.bits
+        end = (CompiledPassageMap.END,)
+
+        path = [CompiledPassageMap.START]
+        for _ in range(end_passages[CompiledPassageMap.START]):
+            yield tuple(path) + end
+        stack = [(iter(passages[CompiledPassageMap.START]),
+                  bits[CompiledPassageMap.START], part_1)]
+        while stack:
+            caves, visited, travel_twice = stack[-1]
+            for cave in caves:
+                bit = bits[cave]
+                if visited & bit:
+                    if travel_twice:
+                        continue
+                    state = (iter(passages[cave]), visited, True)
+                else:
+                    state = (iter(passages[cave]), visited | bit, travel_twice)
+
+                path.append(cave)
+                for _ in range(end_passages[cave]):
+                    yield tuple(path) + end
+                stack.append(state)
+                break
+            else:
+                # all the passages of the last cave are done
+                stack.pop()
+                path.pop()
+
+    def count_by_length(self, part_1):
+        # Number of paths to end by their number of caves, start and end
+        # included, like the tuples of paths. Each state of count_paths keeps
+        # the number of paths to end by number of moves instead of the total
+        counts = self.__count_lengths_from(CompiledPassageMap.START,
+                                           self.bits[CompiledPassageMap.START], int(part_1))
+        return {moves + 1: paths for moves, paths in enumerate(counts) if paths}
+
+    def __count_lengths_from(self, node, visited, travel_twice):
+        state = ((visited * len(self.names) + node) << 1) | travel_twice
+        counts = self.__length_counts.get(state)
+        if counts is not None:
+            return counts
+
+        # counts[moves] is the number of paths to end with that number of moves
+        counts = [0, self.end_passages[node]]
+        bits = self.bits
+        for cave in self.passages[node]:
+            bit = bits[cave]
+            if visited & bit:
+                if travel_twice:
+                    continue
+                cave_counts = self.__count_lengths_from(cave, visited, 1)
+            else:
+                cave_counts = self.__count_lengths_from(cave, visited | bit, travel_twice)
+
+            if len(cave_counts) + 1 > len(counts):
+                counts.extend([0] * (len(cave_counts) + 1 - len(counts)))
+            for moves, paths in enumerate(cave_counts):
+                counts[moves + 1] += paths
+
+        self.__length_counts[state] = counts
+        return counts
+
+class ContractedPassageMap:
+    # The small caves of a CompiledPassageMap with the big caves contracted.
+    # A big cave can always be visited again, so going from a small cave to
+    # another one through a big cave is just one more way of going between the
+    # two small caves. The passages between small caves have a weight, the
+    # number of ways to go from one to the other directly or through a single
+    # big cave, and a path of the contracted graph stands for the product of its
+    # weights paths of the original graph. A small cave can be connected to
+    # itself through a big cave, that passage is a second visit of the cave
+    def __init__(self, compiled):
+        self.names = compiled.names[:compiled.small_count]
+        self.fingerprint = compiled.fingerprint
+        self.original_caves = len(compiled.names)
+        self.original_passages = compiled.passage_count
+
+        # (cave, weight) passages of each small cave without start and end and
+        # the number of ways to reach end from it
+        self.passages = []
+        self.end_weights = []
+        edges = set()
+        for node in range(compiled.small_count):
+            weights = {}
+            end_weight = compiled.end_passages[node]
+            for cave in compiled.passages[node]:
+                if compiled.is_small[cave]:
+                    weights[cave] = weights.get(cave, 0) + 1
+                else:
+                    # through the big cave, its passages only go to small caves
+                    for other in compiled.passages[cave]:
+                        weights[other] = weights.get(other, 0) + 1
+                    end_weight += compiled.end_passages[cave]
+
+            self.passages.append(tuple(sorted(weights.items())))
+            self.end_weights.append(end_weight)
+            edges.update((min(node, cave), max(node, cave)) for cave in weights)
+            if end_weight:
+                edges.add((CompiledPassageMap.END, node))
+
+        self.passage_count = len(edges)
+
+        # Number of paths to end from each state of count_paths
+        self.__path_counts = {}
+
+    def reduction(self):
+        return (f"caves {self.original_caves} -> {len(self.names)}, "
+                f"passages {self.original_passages} -> {self.passage_count}")
+
+    def depth_first_search(self, part_1, node=CompiledPassageMap.START, visited=None,
+                           travel_twice=None):
+        # Number of paths to end, the contracted paths are found one by one and
+        # each one adds the product of its weights
+        if visited is None:
+            visited = 1 << node
+        if travel_twice is None:
+            travel_twice = part_1
+
+        passages = self.passages
+        end_weights = self.end_weights
+
+        def search(node, visited, travel_twice):
+            paths = end_weights[node]
+            for cave, weight in passages[node]:
+                bit = 1 << cave
+                if visited & bit:
+                    if not travel_twice:
+                        paths += weight * search(cave, visited, True)
+                else:
+                    paths += weight * search(cave, visited | bit, travel_twice)
+            return paths
+
+        return search(node, visited, travel_twice)
+
+    def count_paths(self, part_1):
+        # Same states as CompiledPassageMap.count_paths, without the big caves
+        return self.__count_from(CompiledPassageMap.START, 1 << CompiledPassageMap.START,
+                                 int(part_1))
+
+    def __count_from(self, node, visited, travel_twice):
+        state = ((visited * len(self.names) + node) << 1) | travel_twice
+        paths = self.__path_counts.get(state)
+        if paths is not None:
+            return paths
+
+        paths = self.end_weights[node]
+        for cave, weight in self.passages[node]:
+            bit = 1 << cave
+            if visited & bit:
+                if not travel_twice:
+                    paths += weight * self.__count_from(cave, visited, 1)
+            else:
+                paths += weight * self.__count_from(cave, visited | bit, travel_twice)
+
+        self.__path_counts[state] = paths
+        return paths
+
+    def count_paths_with_budget(self, revisited_caves, max_visits):
+        # Number of paths to end where at most revisited_caves small caves are
+        # visited more than once, each of them up to max_visits times. Part 1 is
+        # a budget of 0 caves and part 2 of 1 cave up to 2 times. The state keeps
+        # the bitmask of the caves that used all their visits and the visits of
+        # the caves that can still be visited again. Once all the budget is used
+        # no visited cave can be visited again and which ones used it does not
+        # matter, that bitmask is -1 so those states are counted only once
+        if revisited_caves < 0 or max_visits < 1:
+            raise Exception(f"Invalid budget {revisited_caves} caves up to {max_visits} visits")
+        if max_visits == 1:
+            revisited_caves = 0
+
+        passages = self.passages
+        end_weights = self.end_weights
+        path_counts = {}
+
+        def count_from(node, visited, exhausted, revisits):
+            # revisits is a sorted tuple of (cave, visits) of the caves visited
+            # more than once and less than max_visits times
+            if exhausted != -1 and not revisits and bin(exhausted).count('1') == revisited_caves:
+                exhausted = -1
+            state = (node, visited, exhausted, revisits)
+            paths = path_counts.get(state)
+            if paths is not None:
+                return paths
+
+            paths = end_weights[node]
+            for cave, weight in passages[node]:
+                bit = 1 << cave
+                if not visited & bit:
+                    paths += weight * count_from(cave, visited | bit, exhausted, revisits)
+                    continue
+
+                if exhausted == -1 or exhausted & bit:
+                    continue
+                visits = dict(revisits).get(cave, 1)
+                if visits == 1 and bin(exhausted).count('1') + len(revisits) >= revisited_caves:
+                    # no budget left for another revisited cave
+                    continue
+
+                others = tuple(revisit for revisit in revisits if revisit[0] != cave)
+                if visits + 1 == max_visits:
+                    paths += weight * count_from(cave, visited, exhausted | bit, others)
+                else:
+                    paths += weight * count_from(cave, visited, exhausted,
+                                                 tuple(sorted(others + ((cave, visits + 1),))))
+
+            path_counts[state] = paths
+            return paths
+
+        return count_from(CompiledPassageMap.START, 1 << CompiledPassageMap.START, 0, ())
 
 class PassageMap:
+    # Results of count_paths_with_budget for every PassageMap, by budget and
+    # fingerprint of the passages, the least recently used are dropped
+    BUDGET_CACHE_SIZE = 256
+    __budget_counts = OrderedDict()
+
     def __init__(self, part_1):
         self.graph                   = {}
         self.small_caves             = {}
@@ -174,6 +503,11 @@ class PassageMap:
         self.small_cave_travel_twice = False
         self.part_1                  = part_1
 
+        # The graph with integer caves and the graph of only small caves,
+        # built again after the graph changes
+        self.__compiled              = None
+        self.__contracted            = None
+
     def add_node(self, start, end):
         # Add the start and end node in the graph, these are bi-directional graphs
         if start not in self.graph:
@@ -192,35 +526,73 @@ class PassageMap:
         self.graph[start].append(end)
         self.graph[end].append(start)
 
-    def depth_first_search_to_end(self, current_cave='start'):
-        # using depth first search find all the paths to end
-        for cave in self.graph[current_cave]:
-            if cave == 'start':
-                # ignore start cave
-                continue
-
-            if cave == 'end':
-                # we are at the end of the path
-                self.paths_to_end += 1
-                continue
-
-            # Check the small caves we have traverse
-            if cave in self.small_caves:
-                if self.small_caves[cave] >= 1:
-                    if self.part_1 or self.small_cave_travel_twice:
-                        continue
-                    self.small_cave_travel_twice = True
-                self.small_caves[cave] += 1
+        self.__compiled = None
+        self.__contracted = None
 
+    def compile(self):
+        if self.__compiled is None:
+            self.__compiled = CompiledPassageMap(self)
+        return self.__compiled
 
-            # Go deeper
-            self.depth_first_search_to_end(cave)
+    def contract(self):
+        if self.__contracted is None:
+            self.__contracted = ContractedPassageMap(self.compile())
+        return self.__contracted
 
-            if cave in self.small_caves:
-                # decrease the number of small caves
-                self.small_caves[cave] -= 1
-                if self.small_caves[cave] == 1:
-                    self.small_cave_travel_twice = False
+    def depth_first_search_to_end(self, current_cave='start'):
+        # using depth first search find all the paths to end, the search runs
+        # on the contracted graph starting with the small caves already
+        # traversed. From a big cave it runs on the compiled graph, the
+        # contracted graph only has the small caves
+        compiled = self.compile()
+        visited = compiled.bits[compiled.ids[current_cave]]
+        for cave, visits in self.small_caves.items():
+            if visits:
+                visited |= compiled.bits[compiled.ids[cave]]
+        travel_twice = self.part_1 or self.small_cave_travel_twice
+
+        search = self.contract() if current_cave.islower() else compiled
+        self.paths_to_end += search.depth_first_search(self.part_1, compiled.ids[current_cave],
+                                                       visited, travel_twice)
+
+    def count_paths(self, part_1=None):
+        # Number of paths to end counted over the states of the search on the
+        # contracted graph, see CompiledPassageMap.count_paths
+        if part_1 is None:
+            part_1 = self.part_1
+        return self.contract().count_paths(part_1)
+
+    def count_paths_with_budget(self, revisited_caves=1, max_visits=2):
+        # Number of paths to end with at most revisited_caves small caves visited
+        # more than once, each up to max_visits times. The same query over the
+        # same passages, from this or any other PassageMap, comes from the cache
+        key = (revisited_caves, max_visits, self.compile().fingerprint)
+        if key in PassageMap.__budget_counts:
+            PassageMap.__budget_counts.move_to_end(key)
+            return PassageMap.__budget_counts[key]
+
+        paths = self.contract().count_paths_with_budget(revisited_caves, max_visits)
+        PassageMap.__budget_counts[key] = paths
+        if len(PassageMap.__budget_counts) > PassageMap.BUDGET_CACHE_SIZE:
+            PassageMap.__budget_counts.popitem(last=False)
+        return paths
+
+    @staticmethod
+    def clear_budget_cache():
+        PassageMap.__budget_counts.clear()
+
+    def paths(self, part_1=None):
+        # Paths to end as tuples of the cave ids of compile(), its names turn
+        # them back into cave names
+        if part_1 is None:
+            part_1 = self.part_1
+        return self.compile().paths(part_1)
+
+    def count_by_length(self, part_1=None):
+        # Number of paths to end by number of caves in the path
+        if part_1 is None:
+            part_1 = self.part_1
+        return self.compile().count_by_length(part_1)
 
     def number_paths_to_end(self):
         return self.paths_to_end
@@ -229,22 +601,19 @@ class PassageMap:
         self.paths_to_end = 0
         self.part_1 = part_1
 
-passage_map = PassageMap(part_1=True)
-
-with open('input_data.txt', 'r') as f:
-    line = f.readline()
-    while line:
-        start, end = line.strip().split('-')
-
-        passage_map.add_node(start, end)
+if __name__ == '__main__':
+    passage_map = PassageMap(part_1=True)
 
+    with open('input_data.txt', 'r') as f:
         line = f.readline()
+        while line:
+            start, end = line.strip().split('-')
 
+            passage_map.add_node(start, end)
 
-passage_map.depth_first_search_to_end()
-print(f"number of paths to end for part-1: {passage_map.number_paths_to_end()}")
+            line = f.readline()
 
-passage_map.reset(part_1=False)
-passage_map.depth_first_search_to_end()
-print(f"number of paths to end for part-2: {passage_map.number_paths_to_end()}")
 
+    print(f"contracted cave system: {passage_map.contract().reduction()}")
+    print(f"number of paths to end for part-1: {passage_map.count_paths(part_1=True)}")
+    print(f"number of paths to end for part-2: {passage_map.count_paths(part_1=False)}")
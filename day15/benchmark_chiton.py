@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+'''
+Benchmarks for the day 15 chiton map.
+
+Compares the shortest path engines on maps of growing size, and repairing the
+cached distance field after risk changes with computing the whole field again,
+for single changes and for batches of changes. Batches above Map.REPAIR_LIMIT
+drop the field, so both sides compute it again.
+
+The numpy engine needs a sweep every time the cheapest paths turn, on random
+maps that grows with the size of the map and the heap engine is faster. On maps
+made of large blocks of the same risk the paths turn a few times and the numpy
+engine wins.
+
+The parallel engine is measured with a growing number of workers up to the
+number of cores.
+
+usage: benchmark_chiton.py [map size] [number of changes]
+'''
+
+import os
+import random
+import sys
+import time
+
+from chiton import Map, np
+
+
+def random_map(size, seed=15):
+    random.seed(seed)
+    chiton_map = Map()
+    for _ in range(size):
+        chiton_map.add_row([random.randint(1, 9) for _ in range(size)])
+    return chiton_map
+
+
+def block_map(size, seed=15):
+    # Map made of blocks of size/10 x size/10 nodes with the same risk
+    random.seed(seed)
+    block = max(1, size // 10)
+    block_risks = [[random.randint(1, 9) for _ in range(size // block + 1)]
+                   for _ in range(size // block + 1)]
+    chiton_map = Map()
+    for y in range(size):
+        chiton_map.add_row([block_risks[y // block][x // block] for x in range(size)])
+    return chiton_map
+
+
+def random_changes(chiton_map, amount):
+    return [(random.randrange(chiton_map.max_x), random.randrange(chiton_map.max_y),
+             random.randint(1, 9)) for _ in range(amount)]
+
+
+def benchmark_engines(sizes, build_map):
+    engines = ['heap', 'buckets']
+    if np is not None:
+        engines.append('numpy')
+    else:
+        print("numpy not installed, skipping the numpy engine")
+
+    for size in sizes:
+        chiton_map = build_map(size)
+        results = []
+        for engine in engines:
+            chiton_map.clear_cache()
+            start = time.perf_counter()
+            distances = chiton_map.find_shortest_path(0, 0, engine)
+            elapsed = time.perf_counter() - start
+            results.append(f"{engine} {elapsed*1000:9.1f} ms")
+            if engine == 'heap':
+                expected = distances
+            elif distances != expected:
+                raise Exception(f"The {engine} engine does not match the heap engine")
+
+        sweeps = f"  ({chiton_map.sweeps} sweeps)" if np is not None else ""
+        print(f"{size:>5}x{size:<5} " + "  ".join(results) + sweeps)
+
+
+def benchmark_parallel(size):
+    chiton_map = random_map(size)
+    start = time.perf_counter()
+    expected = chiton_map.find_shortest_path(0, 0, 'buckets')
+    print(f"{size}x{size} buckets {(time.perf_counter() - start)*1000:9.1f} ms")
+
+    workers = 1
+    cores = os.cpu_count() or 1
+    while True:
+        chiton_map.clear_cache()
+        start = time.perf_counter()
+        distances = chiton_map.find_shortest_path(0, 0, 'parallel', workers)
+        print(f"{size}x{size} parallel with {workers:>2} workers "
+              f"{(time.perf_counter() - start)*1000:9.1f} ms")
+        if distances != expected:
+            raise Exception("The parallel engine does not match the buckets engine")
+        if workers >= cores:
+            break
+        workers = min(workers * 2, cores)
+
+
+def full_recompute(chiton_map, changes):
+    # Apply the changes dropping the cached field, then compute it again
+    start = time.perf_counter()
+    chiton_map.clear_cache()
+    chiton_map.update_risks(changes)
+    distances = chiton_map.find_shortest_path(0, 0)
+    return time.perf_counter() - start, distances
+
+
+def incremental(chiton_map, changes):
+    start = time.perf_counter()
+    chiton_map.update_risks(changes)
+    distances = chiton_map.find_shortest_path(0, 0)
+    return time.perf_counter() - start, distances
+
+
+def benchmark_updates(size, changes_count):
+    incremental_map = random_map(size)
+    full_map = random_map(size)
+    incremental_map.find_shortest_path(0, 0)
+
+    print(f"Map of {size}x{size}, {changes_count} rounds of changes")
+    for batch_size in (1, 10, 100, 1000):
+        incremental_time = 0
+        full_time = 0
+        for _ in range(changes_count):
+            changes = random_changes(incremental_map, batch_size)
+            t, repaired = incremental(incremental_map, changes)
+            incremental_time += t
+            t, computed = full_recompute(full_map, changes)
+            full_time += t
+            if repaired != computed:
+                raise Exception("Repaired distances do not match the full computation")
+
+        print(f"batch of {batch_size:>3}: incremental {incremental_time/changes_count*1000:8.2f} ms"
+              f"  full {full_time/changes_count*1000:8.2f} ms"
+              f"  speedup {full_time/incremental_time:6.1f}x")
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    changes_count = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    sizes = [size // 4, size // 2, size, size * 2, size * 5]
+    print("Random risks")
+    benchmark_engines(sizes, random_map)
+    print("Blocks of the same risk")
+    benchmark_engines(sizes, block_map)
+    benchmark_parallel(size * 5)
+    benchmark_updates(size, changes_count)
@@ -4,7 +4,18 @@
 
 '''
 
-from queue import PriorityQueue
+import os
+from array import array
+from collections import OrderedDict
+from heapq import heapify, heappop, heappush
+from multiprocessing import Pipe, Process
+from multiprocessing.shared_memory import SharedMemory
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is only needed by the numpy engine
+    np = None
 
 class Node:
     def __init__(self, x, y, val):
@@ -53,21 +64,39 @@ class Node:
 
 
 class Map:
-    def __init__(self):
-        # The map is set as a dict with each elemement is a node with the nodes connected to it
-        # For example:
-        # {
-        #     Node(0,0,1): [Node(1,0,1), Node(0,1,1)],
-        #     Node(1,0,1): [Node(0,0,1), Node(1,1,3), Node(0,2,6)],
-        # }
-        self.__map = []
-        self.__visited = set()
-        self.__distances = {}
+    # Largest value an array('I') slot can hold, used as "not reached yet"
+    UNREACHED = 2**32 - 1
+
+    # update_risks drops the cached fields instead of repairing them when a
+    # batch has more than REPAIR_LIMIT * sqrt(nodes) changes. Measured on random
+    # maps the repair stops being faster than computing again at about 20
+    # changes on 60x60 and 110 changes on 250x250, the limit keeps a margin
+    REPAIR_LIMIT = 0.3
+
+    def __init__(self, cache_size=8):
+        # The map is stored as a flat array of risks, the risk of the node (x, y)
+        # is at the index y*width+x. For example the map:
+        # 116
+        # 138
+        # is stored as array('I', [1, 1, 6, 1, 3, 8]) with a width of 3
+        self.__risks = array('I')
         self.__max_x = 0
         self.__max_y = 0
+        self.__max_risk = 0
+        self.__min_risk = None
 
-        # use during the add row function
-        self.__previous_row = None
+        # number of nodes settled by the last shortest_path query or risk update
+        self.__settled_nodes = 0
+
+        # number of relaxation sweeps needed by the last numpy search
+        self.__sweeps = 0
+
+        # Completed distance fields, the key is the tuple of sorted source indexes
+        # and the value is (distances, predecessors). The least recently used field
+        # is dropped when there are more than cache_size fields
+        self.__fields = OrderedDict()
+        self.__cache_size = cache_size
+        self.__last_sources = None
 
 
     def __str__(self):
@@ -82,88 +111,770 @@ class Map:
     def max_x(self):
         return self.__max_x
 
-    def add_row(self, row):
-        row_values = []
-        current_values = len(self.__map)
-        for index, value in enumerate(row):
-            value = int(value)
-            row_values.append(value)
-            self.__distances[(index, self.__max_y)] = float("inf")
-        self.__map.append(row_values)
-
-        self.__max_y += 1
+    @property
+    def max_risk(self):
+        return self.__max_risk
 
+    @property
+    def min_risk(self):
+        return self.__min_risk or 0
 
+    @property
+    def settled_nodes(self):
+        return self.__settled_nodes
 
-    def find_shortest_path(self, start_x, start_y):
-        # find the shortest path for all nodes using Dijkstra
-        start = (start_x, start_y)
-        if start not in self.__distances:
-            Exception("Invalid starting point")
+    @property
+    def sweeps(self):
+        return self.__sweeps
 
-        self.__distances[start] = 0
+    @property
+    def size(self):
+        return self.max_x * self.max_y
 
-        queue = PriorityQueue()
-        queue.put((0, start))
+    @property
+    def risks(self):
+        return self.__risks
 
-        while not queue.empty():
-            dist, cur_pos = queue.get()
-            self.__visited.add(cur_pos)
+    def index(self, x, y):
+        # Position of the node (x, y) in the flat arrays
+        if x < 0 or y < 0 or x >= self.max_x or y >= self.max_y:
+            raise Exception(f"Invalid point ({x}, {y})")
+        return y * self.max_x + x
 
-            neighbors = [(cur_pos[0]-1, cur_pos[1]), (cur_pos[0], cur_pos[1]-1),
-                         (cur_pos[0]+1, cur_pos[1]), (cur_pos[0], cur_pos[1]+1)]
+    def add_row(self, row):
+        row_values = array('I', [int(value) for value in row])
+        if self.__max_y == 0:
+            self.__max_x = len(row_values)
+        elif len(row_values) != self.__max_x:
+            raise Exception(f"Invalid row size {len(row_values)}, expected {self.__max_x}")
+
+        self.__risks.extend(row_values)
+        self.__fields.clear()
+        self.__last_sources = None
+        self.__max_risk = max(self.__max_risk, max(row_values, default=0))
+        row_min = min(row_values, default=0)
+        if self.__min_risk is None or row_min < self.__min_risk:
+            self.__min_risk = row_min
+        self.__max_y += 1
 
-            for neighbor in neighbors:
-                if neighbor[0] < 0 or neighbor[1] < 0 or \
-                    neighbor[0] >= len(self.__map[0]) or neighbor[1] >= len(self.__map):
+    def _new_distances(self, full_field):
+        # Storage for the distances of a search, full_field is True when the
+        # search will reach every node of the map
+        return array('I', [Map.UNREACHED]) * self.size
+
+    def get_risk(self, x, y):
+        return self.risks[self.index(x, y)]
+
+    def neighbors(self, index):
+        # Indexes of the nodes up, left, right and down of the given index
+        width = self.max_x
+        x = index % width
+        if index >= width:
+            yield index - width
+        if x > 0:
+            yield index - 1
+        if x < width - 1:
+            yield index + 1
+        if index + width < self.size:
+            yield index + width
+
+    def find_shortest_path(self, start_x, start_y, engine='heap', workers=None):
+        # find the shortest path for all nodes using Dijkstra
+        # engine selects how the frontier is kept:
+        #   heap:    a binary heap, works for any risk value
+        #   buckets: Dial's algorithm, a circular array of max_risk+1 buckets. The
+        #            risks are small integers so there is no need to sort the frontier
+        #   numpy:   whole map relaxation sweeps with numpy until nothing changes,
+        #            worth it for maps with millions of nodes
+        #   parallel: delta-stepping with the map split in horizontal bands, one
+        #            process per band. workers is the number of processes, by
+        #            default one per core
+        return self.find_shortest_paths([(start_x, start_y)], engine, workers)
+
+    def find_shortest_paths(self, starts, engine='heap', workers=None):
+        # Multi-source Dijkstra, the distance of each node is the cost from the
+        # closest of the starts (list of (x, y)). Completed fields are cached so
+        # asking again for the same starts does not run the search again
+        sources = tuple(sorted(set(self.index(x, y) for x, y in starts)))
+        if not sources:
+            raise Exception("No starting point")
+
+        field = self.__fields.get(sources)
+        if field is None:
+            if engine == 'heap':
+                field = self.__dijkstra_heap(sources)
+            elif engine == 'buckets':
+                field = self.__dijkstra_buckets(sources)
+            elif engine == 'numpy':
+                field = self.__wavefront_numpy(sources)
+            elif engine == 'parallel':
+                field = self.__delta_stepping(sources, workers or os.cpu_count() or 1)
+            else:
+                raise Exception(f"Invalid engine {engine}")
+            self.__fields[sources] = field
+            if len(self.__fields) > self.__cache_size:
+                self.__fields.popitem(last=False)
+        else:
+            self.__fields.move_to_end(sources)
+
+        self.__last_sources = sources
+        return field[0]
+
+    def path_to(self, goal, starts=None):
+        # Cheapest route as a list of (x, y) from one of the starts to goal.
+        # starts defaults to the ones of the last distance field computed
+        if starts is not None:
+            self.find_shortest_paths(starts)
+        if self.__last_sources not in self.__fields:
+            raise Exception("No distance field computed")
+
+        distances, predecessors = self.__fields[self.__last_sources]
+        cur_pos = self.index(*goal)
+        if distances[cur_pos] == Map.UNREACHED:
+            return None
+
+        width = self.max_x
+        path = []
+        while cur_pos != Map.UNREACHED:
+            path.append((cur_pos % width, cur_pos // width))
+            cur_pos = predecessors[cur_pos]
+        path.reverse()
+        return path
+
+    def __dijkstra_heap(self, sources):
+        # The distances are kept in a flat array with the same layout as the risks
+        # and the frontier is a plain heap. Instead of updating an entry already in
+        # the heap a new one is pushed, the old (stale) entry is ignored when it is
+        # popped because its distance is bigger than the one stored in the array
+        risks = self.risks
+        width = self.max_x
+        size = self.size
+        distances = self._new_distances(full_field=True)
+        predecessors = self._new_distances(full_field=True)
+        for start in sources:
+            distances[start] = 0
+
+        frontier = [(0, start) for start in sources]
+        while frontier:
+            dist, cur_pos = heappop(frontier)
+            if dist > distances[cur_pos]:
+                # stale entry, the node was already settled with a lower cost
+                continue
+
+            x = cur_pos % width
+            for neighbor in (cur_pos - width if cur_pos >= width else -1,
+                             cur_pos - 1 if x > 0 else -1,
+                             cur_pos + 1 if x < width - 1 else -1,
+                             cur_pos + width if cur_pos + width < size else -1):
+                if neighbor < 0:
+                    # out of bound
+                    continue
+
+                new_cost = dist + risks[neighbor]
+                if new_cost < distances[neighbor]:
+                    distances[neighbor] = new_cost
+                    predecessors[neighbor] = cur_pos
+                    heappush(frontier, (new_cost, neighbor))
+
+        return distances, predecessors
+
+    def __dijkstra_buckets(self, sources):
+        # Every new distance is at most max_risk bigger than the distance being
+        # settled, so max_risk+1 buckets indexed by distance % len(buckets) are
+        # enough to hold the whole frontier. Buckets are visited in order of
+        # distance, every node in the current bucket is already settled
+        risks = self.risks
+        width = self.max_x
+        size = self.size
+        distances = self._new_distances(full_field=True)
+        predecessors = self._new_distances(full_field=True)
+        for start in sources:
+            distances[start] = 0
+
+        buckets = [[] for _ in range(self.max_risk + 1)]
+        num_buckets = len(buckets)
+        buckets[0].extend(sources)
+        pending = len(sources)
+        dist = 0
+        while pending:
+            bucket = buckets[dist % num_buckets]
+            while bucket:
+                cur_pos = bucket.pop()
+                pending -= 1
+                if dist != distances[cur_pos]:
+                    # stale entry, the node was moved to a lower bucket
+                    continue
+
+                x = cur_pos % width
+                for neighbor in (cur_pos - width if cur_pos >= width else -1,
+                                 cur_pos - 1 if x > 0 else -1,
+                                 cur_pos + 1 if x < width - 1 else -1,
+                                 cur_pos + width if cur_pos + width < size else -1):
+                    if neighbor < 0:
                         # out of bound
                         continue
 
-                if neighbor not in self.__visited:
-                    self.__visited.add(neighbor)
-                    old_cost = self.__distances[neighbor]
-                    new_cost = self.__distances[cur_pos] + self.__map[neighbor[0]][neighbor[1]]
-                    if new_cost < old_cost:
-                        queue.put((new_cost, neighbor))
-                        self.__distances[neighbor] = new_cost
-
-        return self.__distances
+                    new_cost = dist + risks[neighbor]
+                    if new_cost < distances[neighbor]:
+                        distances[neighbor] = new_cost
+                        predecessors[neighbor] = cur_pos
+                        buckets[new_cost % num_buckets].append(neighbor)
+                        pending += 1
+            dist += 1
+
+        return distances, predecessors
+
+    def __wavefront_numpy(self, sources):
+        # Bellman-Ford on the whole grid at once. Each sweep relaxes every row from
+        # left to right and right to left, then every column down and up. A scan
+        # along a row uses the prefix sums of the risks P, reaching x from any k
+        # before it costs dist[k] + P[x] - P[k], so the best cost for all the row
+        # is P + cumulative minimum of (dist - P). Paths can go straight for any
+        # length in one sweep, the number of sweeps depends on how many times the
+        # paths turn. Once a sweep changes nothing the distances are final. The
+        # predecessor of a node is any neighbor that gives its final distance
+        if np is None:
+            raise Exception("The numpy engine needs numpy installed")
+
+        height, width = self.max_y, self.max_x
+        if isinstance(self.risks, array):
+            risks = np.frombuffer(self.risks, dtype=np.uint32).astype(np.int64)
+        else:
+            risks = np.fromiter((self.risks[i] for i in range(self.size)),
+                                dtype=np.int64, count=self.size)
+        risks = risks.reshape(height, width)
+
+        distances = np.full((height, width), Map.UNREACHED, dtype=np.int64)
+        is_source = np.zeros((height, width), dtype=bool)
+        for start in sources:
+            distances[start // width, start % width] = 0
+            is_source[start // width, start % width] = True
+
+        # (slice of the nodes, slice of their neighbors, offset to the neighbor index)
+        directions = (
+            ((slice(1, None), slice(None)), (slice(None, -1), slice(None)), -width),
+            ((slice(None, -1), slice(None)), (slice(1, None), slice(None)), width),
+            ((slice(None), slice(1, None)), (slice(None), slice(None, -1)), -1),
+            ((slice(None), slice(None, -1)), (slice(None), slice(1, None)), 1),
+        )
+
+        # Prefix sums of the risks for each scan, they do not change between sweeps
+        rows_forward = np.cumsum(risks, axis=1)
+        rows_backward = np.cumsum(risks[:, ::-1], axis=1)
+        columns_forward = np.cumsum(risks.T, axis=1)
+        columns_backward = np.cumsum(risks.T[:, ::-1], axis=1)
+
+        def scan(block, forward, backward):
+            # Scan each row of block forward and backward, return which positions
+            # along the rows changed in any of them
+            before = block.copy()
+            for view, prefix in ((block, forward), (block[:, ::-1], backward)):
+                best = np.minimum.accumulate(view - prefix, axis=1)
+                best += prefix
+                np.minimum(view, best, out=view)
+            return (block != before).any(axis=0)
+
+        # Only the rows (columns) with a node changed by the last column (row) scan
+        # can improve, the rest are skipped
+        active_rows = np.ones(height, dtype=bool)
+        active_columns = np.ones(width, dtype=bool)
+        self.__sweeps = 0
+        while active_rows.any() or active_columns.any():
+            self.__sweeps += 1
+            rows = np.flatnonzero(active_rows)
+            active_rows[:] = False
+            if rows.size:
+                block = distances[rows]
+                active_columns |= scan(block, rows_forward[rows], rows_backward[rows])
+                distances[rows] = block
+
+            columns = np.flatnonzero(active_columns)
+            active_columns[:] = False
+            if columns.size:
+                block = np.ascontiguousarray(distances.T[columns])
+                active_rows |= scan(block, columns_forward[columns], columns_backward[columns])
+                distances[:, columns] = block.T
+
+        node_index = np.arange(height * width, dtype=np.int64).reshape(height, width)
+        predecessors = np.full((height, width), Map.UNREACHED, dtype=np.int64)
+        for nodes, neighbors, offset in directions:
+            found = ((predecessors[nodes] == Map.UNREACHED) & ~is_source[nodes] &
+                     (distances[nodes] != Map.UNREACHED) &
+                     (distances[neighbors] + risks[nodes] == distances[nodes]))
+            predecessors[nodes][found] = node_index[nodes][found] + offset
+
+        field = array('I'), array('I')
+        field[0].frombytes(distances.astype(np.uint32).tobytes())
+        field[1].frombytes(predecessors.astype(np.uint32).tobytes())
+        return field
+
+    def __delta_stepping(self, sources, workers):
+        # The risks, distances and predecessors live in shared memory and the map
+        # is split in one band of rows per worker. The search runs in phases, each
+        # phase settles the nodes with a distance below a threshold that grows by
+        # delta every phase. Within a phase every worker runs Dijkstra on its band
+        # for the nodes below the threshold (the light relaxations), the nodes
+        # above it are kept for the following phases. Workers only write their own
+        # band, when the first or last row of a band changes the neighbor band
+        # pulls the new costs in the next round. A phase is over when a round
+        # changes no band boundary
+        width, height, size = self.max_x, self.max_y, self.size
+        workers = max(1, min(workers, height))
+        delta = 4 * max(self.max_risk, 1)
+
+        risks_memory = SharedMemory(create=True, size=size * 4)
+        distances_memory = SharedMemory(create=True, size=size * 4)
+        predecessors_memory = SharedMemory(create=True, size=size * 4)
+        processes = []
+        connections = []
+        try:
+            risks = risks_memory.buf.cast('I')
+            if isinstance(self.risks, array):
+                risks[:] = self.risks
+            else:
+                for i in range(size):
+                    risks[i] = self.risks[i]
+            risks.release()
+            distances = distances_memory.buf.cast('I')
+            distances[:] = array('I', [Map.UNREACHED]) * size
+            for start in sources:
+                distances[start] = 0
+            distances.release()
+            predecessors = predecessors_memory.buf.cast('I')
+            predecessors[:] = array('I', [Map.UNREACHED]) * size
+            predecessors.release()
+
+            bands = [(height * i // workers, height * (i + 1) // workers) for i in range(workers)]
+            for first_row, last_row in bands:
+                connection, worker_connection = Pipe()
+                band_sources = [s for s in sources if first_row * width <= s < last_row * width]
+                process = Process(target=delta_stepping_band, daemon=True,
+                                  args=(worker_connection, risks_memory.name, distances_memory.name,
+                                        predecessors_memory.name, width, first_row, last_row,
+                                        band_sources))
+                process.start()
+                processes.append(process)
+                connections.append(connection)
+
+            threshold = delta
+            pull_above = [False] * workers
+            pull_below = [False] * workers
+            while True:
+                for i, connection in enumerate(connections):
+                    connection.send((threshold, pull_above[i], pull_below[i]))
+                results = [connection.recv() for connection in connections]
+
+                pull_above = [i > 0 and results[i-1][1] for i in range(workers)]
+                pull_below = [i < workers - 1 and results[i+1][0] for i in range(workers)]
+                if any(pull_above) or any(pull_below):
+                    # boundaries changed, another round of this phase
+                    continue
+
+                pending = [result[2] for result in results if result[2] is not None]
+                if not pending:
+                    break
+                threshold = (min(pending) // delta + 1) * delta
+
+            for connection in connections:
+                connection.send(None)
+            for process in processes:
+                process.join()
+
+            field = array('I'), array('I')
+            field[0].frombytes(distances_memory.buf[:size * 4])
+            field[1].frombytes(predecessors_memory.buf[:size * 4])
+            return field
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            for memory in (risks_memory, distances_memory, predecessors_memory):
+                memory.close()
+                memory.unlink()
+
+    def shortest_path(self, start, goal, method='astar'):
+        # Cost of the cheapest path between the points start and goal, given as
+        # (x, y) tuples. Unlike find_shortest_path the search stops as soon as the
+        # goal is settled. method can be:
+        #   dijkstra:      plain Dijkstra with early exit
+        #   astar:         A* using the manhattan distance times the lowest risk
+        #   bidirectional: Dijkstra from both ends until the searches meet
+        start = self.index(*start)
+        goal = self.index(*goal)
+        self.__settled_nodes = 0
+
+        if start == goal:
+            return 0
+
+        field = self.__fields.get((start,))
+        if field is not None:
+            # the whole distance field from start is already known
+            self.__fields.move_to_end((start,))
+            return field[0][goal] if field[0][goal] != Map.UNREACHED else None
+
+        if method == 'dijkstra':
+            return self.__astar(start, goal, 0)
+        elif method == 'astar':
+            return self.__astar(start, goal, self.min_risk)
+        elif method == 'bidirectional':
+            return self.__bidirectional(start, goal)
+        raise Exception(f"Invalid method {method}")
+
+    def __astar(self, start, goal, min_risk):
+        # The heuristic is the manhattan distance to the goal times the lowest risk
+        # in the map. Every step costs at least min_risk so it never overestimates.
+        # With min_risk = 0 this is plain Dijkstra
+        risks = self.risks
+        width = self.max_x
+        size = self.size
+        goal_y, goal_x = divmod(goal, width)
+        distances = self._new_distances(full_field=False)
+        distances[start] = 0
+
+        start_y, start_x = divmod(start, width)
+        frontier = [((abs(goal_x - start_x) + abs(goal_y - start_y)) * min_risk, 0, start)]
+        while frontier:
+            _, dist, cur_pos = heappop(frontier)
+            if dist > distances[cur_pos]:
+                # stale entry
+                continue
+
+            self.__settled_nodes += 1
+            if cur_pos == goal:
+                return dist
+
+            x = cur_pos % width
+            for neighbor in (cur_pos - width if cur_pos >= width else -1,
+                             cur_pos - 1 if x > 0 else -1,
+                             cur_pos + 1 if x < width - 1 else -1,
+                             cur_pos + width if cur_pos + width < size else -1):
+                if neighbor < 0:
+                    # out of bound
+                    continue
+
+                new_cost = dist + risks[neighbor]
+                if new_cost < distances[neighbor]:
+                    distances[neighbor] = new_cost
+                    n_y, n_x = divmod(neighbor, width)
+                    estimate = (abs(goal_x - n_x) + abs(goal_y - n_y)) * min_risk
+                    heappush(frontier, (new_cost + estimate, new_cost, neighbor))
+
+        return None
+
+    def __bidirectional(self, start, goal):
+        # Run Dijkstra forward from start and backward from goal, always expanding
+        # the side with the cheapest frontier. Moving into a node costs its risk, so
+        # going backward from a node to its neighbor costs the risk of the node
+        # we leave. best is the cheapest path found joining both searches, once
+        # both frontiers together cost more than best no better path exists
+        risks = self.risks
+        width = self.max_x
+        size = self.size
+
+        forward = self._new_distances(full_field=False)
+        backward = self._new_distances(full_field=False)
+        forward[start] = 0
+        backward[goal] = 0
+        forward_frontier = [(0, start)]
+        backward_frontier = [(0, goal)]
+
+        best = Map.UNREACHED
+        while forward_frontier and backward_frontier:
+            if forward_frontier[0][0] + backward_frontier[0][0] >= best:
+                break
+
+            if forward_frontier[0][0] <= backward_frontier[0][0]:
+                frontier, distances, other = forward_frontier, forward, backward
+                is_forward = True
+            else:
+                frontier, distances, other = backward_frontier, backward, forward
+                is_forward = False
+
+            dist, cur_pos = heappop(frontier)
+            if dist > distances[cur_pos]:
+                # stale entry
+                continue
+
+            self.__settled_nodes += 1
+            x = cur_pos % width
+            for neighbor in (cur_pos - width if cur_pos >= width else -1,
+                             cur_pos - 1 if x > 0 else -1,
+                             cur_pos + 1 if x < width - 1 else -1,
+                             cur_pos + width if cur_pos + width < size else -1):
+                if neighbor < 0:
+                    # out of bound
+                    continue
+
+                new_cost = dist + (risks[neighbor] if is_forward else risks[cur_pos])
+                if new_cost < distances[neighbor]:
+                    distances[neighbor] = new_cost
+                    heappush(frontier, (new_cost, neighbor))
+
+                if other[neighbor] != Map.UNREACHED and new_cost + other[neighbor] < best:
+                    best = new_cost + other[neighbor]
+
+        return best if best != Map.UNREACHED else None
+
+    def clear_cache(self):
+        # Forget all the computed distance fields
+        self.__fields.clear()
+        self.__last_sources = None
+
+    def update_risk(self, x, y, new_value):
+        # Change the risk of a node and repair the cached distance fields instead
+        # of computing them again. Only the nodes whose distance changes are visited
+        self.update_risks([(x, y, new_value)])
+
+    def update_risks(self, changes):
+        # Apply a batch of (x, y, new_value) changes and repair each cached field
+        # once for the whole batch. For large batches the fields are dropped,
+        # computing them again is cheaper, see REPAIR_LIMIT
+        self.__settled_nodes = 0
+        old_values = {}
+        for x, y, new_value in changes:
+            index = self.index(x, y)
+            old_values.setdefault(index, self.__risks[index])
+            self.__risks[index] = new_value
+            self.__max_risk = max(self.__max_risk, new_value)
+            self.__min_risk = min(self.__min_risk, new_value)
+
+        # net change of each node, nodes changed back to their risk are left out
+        decreased = {index: old - self.__risks[index] for index, old in old_values.items()
+                     if self.__risks[index] < old}
+        increased = [index for index, old in old_values.items() if self.__risks[index] > old]
+        if not decreased and not increased:
+            return
+
+        if len(decreased) + len(increased) > Map.REPAIR_LIMIT * self.size ** 0.5:
+            self.clear_cache()
+            return
+
+        for sources, (distances, predecessors) in self.__fields.items():
+            self.__repair(distances, predecessors, sources, decreased, increased)
+
+    def __repair(self, distances, predecessors, sources, decreased, increased):
+        # Only the nodes whose cheapest path goes through a node that got more
+        # expensive (its subtree in the predecessors tree) can get more expensive.
+        # Their distances are reset and seeded with the best cost from the nodes
+        # outside the subtrees. The nodes that got cheaper keep their predecessor
+        # with a lower cost. A single Dijkstra from all the seeds repairs the rest.
+        # The cost of a start does not depend on its own risk
+        affected = []
+        stack = [index for index in increased
+                 if index not in sources and distances[index] != Map.UNREACHED]
+        for index in stack:
+            distances[index] = Map.UNREACHED
+        while stack:
+            cur_pos = stack.pop()
+            affected.append(cur_pos)
+            for neighbor in self.neighbors(cur_pos):
+                if predecessors[neighbor] == cur_pos and distances[neighbor] != Map.UNREACHED:
+                    distances[neighbor] = Map.UNREACHED
+                    stack.append(neighbor)
+
+        frontier = []
+        for index, decrease in decreased.items():
+            if index in sources or distances[index] == Map.UNREACHED:
+                continue
+            distances[index] -= decrease
+            frontier.append((distances[index], index))
+
+        risks = self.__risks
+        for cur_pos in affected:
+            best, best_neighbor = Map.UNREACHED, Map.UNREACHED
+            for neighbor in self.neighbors(cur_pos):
+                if distances[neighbor] != Map.UNREACHED and distances[neighbor] < best:
+                    best, best_neighbor = distances[neighbor], neighbor
+            predecessors[cur_pos] = best_neighbor
+            if best_neighbor != Map.UNREACHED:
+                distances[cur_pos] = best + risks[cur_pos]
+                frontier.append((distances[cur_pos], cur_pos))
+
+        heapify(frontier)
+        self.__propagate(distances, predecessors, frontier)
+
+    def __propagate(self, distances, predecessors, frontier):
+        # Dijkstra from the nodes in the frontier heap, only lower costs are written
+        risks = self.__risks
+        while frontier:
+            dist, cur_pos = heappop(frontier)
+            if dist > distances[cur_pos]:
+                # stale entry
+                continue
+
+            self.__settled_nodes += 1
+            for neighbor in self.neighbors(cur_pos):
+                new_cost = dist + risks[neighbor]
+                if new_cost < distances[neighbor]:
+                    distances[neighbor] = new_cost
+                    predecessors[neighbor] = cur_pos
+                    heappush(frontier, (new_cost, neighbor))
+
+    def get_distance(self, distances, x, y):
+        return distances[self.index(x, y)]
 
 
     def print_map(self):
-        for row in self.__map:
-            for v in row:
-                print(v, end="")
+        for y in range(self.max_y):
+            for x in range(self.max_x):
+                print(self.get_risk(x, y), end="")
             print()
 
 
-chiton_map = Map()
+def delta_stepping_band(connection, risks_name, distances_name, predecessors_name,
+                        width, first_row, last_row, sources):
+    # Worker of the parallel engine for the rows [first_row, last_row). Each
+    # message is (threshold, pull_above, pull_below), pull_* tells the band
+    # next to it changed its boundary row. The reply is (first row changed,
+    # last row changed, lowest pending distance or None). None stops the worker
+    risks_memory = SharedMemory(name=risks_name)
+    distances_memory = SharedMemory(name=distances_name)
+    predecessors_memory = SharedMemory(name=predecessors_name)
+    risks = risks_memory.buf.cast('I')
+    distances = distances_memory.buf.cast('I')
+    predecessors = predecessors_memory.buf.cast('I')
+
+    band_start = first_row * width
+    band_end = last_row * width
+    frontier = [(0, start) for start in sources]
+    heapify(frontier)
+
+    # the neighbor bands have to pull the starts that are on a boundary row
+    first_changed = any(start < band_start + width for start in sources)
+    last_changed = any(start >= band_end - width for start in sources)
+
+    def relax(cur_pos, neighbor, dist):
+        nonlocal first_changed, last_changed
+        new_cost = dist + risks[neighbor]
+        if new_cost < distances[neighbor]:
+            distances[neighbor] = new_cost
+            predecessors[neighbor] = cur_pos
+            heappush(frontier, (new_cost, neighbor))
+            if neighbor < band_start + width:
+                first_changed = True
+            if neighbor >= band_end - width:
+                last_changed = True
+
+    message = connection.recv()
+    while message is not None:
+        threshold, pull_above, pull_below = message
+
+        # New costs from the neighbor bands, they are written only by their own
+        # worker and can only get lower, any value read is a valid path cost
+        if pull_above:
+            for neighbor in range(band_start, band_start + width):
+                if distances[neighbor - width] != Map.UNREACHED:
+                    relax(neighbor - width, neighbor, distances[neighbor - width])
+        if pull_below:
+            for neighbor in range(band_end - width, band_end):
+                if distances[neighbor + width] != Map.UNREACHED:
+                    relax(neighbor + width, neighbor, distances[neighbor + width])
+
+        while frontier and frontier[0][0] < threshold:
+            dist, cur_pos = heappop(frontier)
+            if dist > distances[cur_pos]:
+                # stale entry
+                continue
+
+            x = cur_pos % width
+            for neighbor in (cur_pos - width if cur_pos - width >= band_start else -1,
+                             cur_pos - 1 if x > 0 else -1,
+                             cur_pos + 1 if x < width - 1 else -1,
+                             cur_pos + width if cur_pos + width < band_end else -1):
+                if neighbor >= 0:
+                    relax(cur_pos, neighbor, dist)
+
+        while frontier and frontier[0][0] > distances[frontier[0][1]]:
+            heappop(frontier)
+        connection.send((first_changed, last_changed, frontier[0][0] if frontier else None))
+        first_changed = last_changed = False
+        message = connection.recv()
+
+    risks.release()
+    distances.release()
+    predecessors.release()
+    for memory in (risks_memory, distances_memory, predecessors_memory):
+        memory.close()
+
+
+class SparseDistances(dict):
+    # Distances for the nodes reached so far, any other node is unreached
+    def __missing__(self, index):
+        return Map.UNREACHED
+
+
+class TiledRisks:
+    # Read only view of the risks of a map repeated factor times in each direction.
+    # Every time the tile is repeated to the right or down its risks increase by 1,
+    # risks above 9 wrap back around to 1
+    def __init__(self, tile_risks, tile_width, tile_height, factor):
+        self.__tile_risks = tile_risks
+        self.__tile_width = tile_width
+        self.__tile_height = tile_height
+        self.__width = tile_width * factor
+        self.__factor = factor
+
+    def __len__(self):
+        return len(self.__tile_risks) * self.__factor * self.__factor
+
+    def __getitem__(self, index):
+        y, x = divmod(index, self.__width)
+        tile_y, y = divmod(y, self.__tile_height)
+        tile_x, x = divmod(x, self.__tile_width)
+        value = self.__tile_risks[y * self.__tile_width + x]
+        return (value + tile_x + tile_y - 1) % 9 + 1
+
+
+class TiledMap(Map):
+    # Map made of the rows added repeated factor times to the right and down.
+    # Only the original tile is stored, the risk of the other nodes is computed
+    # when it is needed. Point to point searches keep only the nodes they reach
+    def __init__(self, factor=5, cache_size=8):
+        super().__init__(cache_size)
+        if factor < 1:
+            raise Exception(f"Invalid tiling factor {factor}")
+        self.__factor = factor
 
-initial_map = []
-with open('input_data.txt', 'r') as f:
-    line = f.readline()
-    while line:
-        line = line.strip()
-        row = []
-        for value in line:
-            row.append(int(value))
-        initial_map.append(row)
-        line = f.readline()
+    @property
+    def factor(self):
+        return self.__factor
+
+    @property
+    def max_x(self):
+        return super().max_x * self.factor
+
+    @property
+    def max_y(self):
+        return super().max_y * self.factor
+
+    @property
+    def max_risk(self):
+        return super().max_risk if self.factor == 1 else 9
+
+    @property
+    def min_risk(self):
+        return super().min_risk if self.factor == 1 else 1
+
+    @property
+    def risks(self):
+        return TiledRisks(super().risks, super().max_x, super().max_y, self.factor)
+
+    def update_risk(self, x, y, new_value):
+        raise Exception("The risks of a tiled map can not be changed")
 
-for extra_y in range(5):
-    for row in initial_map:
-        long_row = []
-        for extra_x in range(5):
-            sub_row = []
-            for value in row:
-                value = value + extra_x + extra_y
-                if value >= 10:
-                    value = value % 10 + 1
-                sub_row.append(value)
+    def _new_distances(self, full_field):
+        if full_field:
+            return super()._new_distances(full_field)
+        return SparseDistances()
 
-            long_row += sub_row
 
-        chiton_map.add_row(long_row)
+if __name__ == '__main__':
+    chiton_map = TiledMap(5)
+
+    with open('input_data.txt', 'r') as f:
+        line = f.readline()
+        while line:
+            chiton_map.add_row(line.strip())
+            line = f.readline()
 
-distances = chiton_map.find_shortest_path(0, 0)
-print(distances[(499, 499)])
+    print(chiton_map.shortest_path((0, 0), (chiton_map.max_x-1, chiton_map.max_y-1)))
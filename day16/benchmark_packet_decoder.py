@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+'''
+Benchmarks for the day 16 BITS decoders.
+
+Random transmissions of growing size are generated with BITS_Encoder. Each one
+is first checked: the packet tree decoded from it must encode back to the same
+hex, and every decoder must give the same sum of versions and value. Then the
+throughput of each decoder is reported in MB of hex per second and packets per
+second.
+
+The batch mode is measured on many small transmissions, one per line, with a
+growing number of processes up to the number of cores.
+
+usage: benchmark_packet_decoder.py [size in KB of hex ...]
+'''
+
+import os
+import sys
+import time
+
+from packet_decoder import (BITS_Encoder, BITS_LazyEvaluator, BITS_PacketStore,
+                            BITS_StreamDecoder, BITS_Transmission)
+
+
+def decode_tree(transmission):
+    decoder = BITS_Transmission()
+    packet = decoder.decode_message(transmission)
+    return decoder.total_versions, packet.get_value()
+
+
+def decode_interned(transmission):
+    decoder = BITS_Transmission()
+    packet = decoder.decode_message(transmission, intern=True)
+    return decoder.total_versions, packet.get_value()
+
+
+def decode_stack(transmission):
+    return BITS_Transmission().evaluate_message(transmission)[:2]
+
+
+def decode_store(transmission):
+    store = BITS_PacketStore(transmission)
+    return store.version_sum(), store.value()
+
+
+def decode_stream(transmission):
+    decoder = BITS_StreamDecoder()
+    for i in range(0, len(transmission), 65536):
+        decoder.feed(transmission[i:i + 65536])
+    return decoder.total_versions, decoder.close()
+
+
+def decode_lazy(transmission):
+    # the lazy evaluator does not sum the versions
+    return None, BITS_LazyEvaluator().evaluate(transmission)
+
+
+DECODERS = {
+    'tree': decode_tree,
+    'interned': decode_interned,
+    'stack': decode_stack,
+    'store': decode_store,
+    'stream': decode_stream,
+    'lazy': decode_lazy,
+}
+
+
+def check_round_trip(transmission):
+    decoder = BITS_Transmission()
+    packet = decoder.decode_message(transmission)
+    if BITS_Encoder().encode(packet) != transmission:
+        raise Exception("The decoded packets do not encode back to the transmission")
+
+    expected = (decoder.total_versions, packet.get_value())
+    for name, decode in DECODERS.items():
+        versions, value = decode(transmission)
+        if value != expected[1] or (versions is not None and versions != expected[0]):
+            raise Exception(f"The {name} decoder does not match the packet tree")
+
+
+def benchmark(size_kb, seed=16):
+    start = time.perf_counter()
+    transmission = BITS_Encoder().generate(size_kb * 1024 * 4, seed=seed)
+    generated = time.perf_counter() - start
+    _, _, packets = BITS_Transmission().evaluate_message(transmission)
+    megabytes = len(transmission) / 1e6
+    print(f"{len(transmission) / 1024:.0f} KB of hex, {packets} packets "
+          f"(generated in {generated:.2f} s)")
+
+    check_round_trip(transmission)
+    for name, decode in DECODERS.items():
+        start = time.perf_counter()
+        decode(transmission)
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<9} {megabytes / elapsed:8.2f} MB/s  {packets / elapsed:12.0f} packets/s")
+
+
+def benchmark_batch(lines_count, seed=16):
+    encoder = BITS_Encoder()
+    lines = [encoder.generate(256, seed=seed + i, depth=4) for i in range(lines_count)]
+    print(f"{lines_count} transmissions of about {len(lines[0])} hex each")
+
+    expected = None
+    processes = 1
+    cores = os.cpu_count() or 1
+    while True:
+        start = time.perf_counter()
+        results = BITS_Transmission.decode_batch(lines, processes, chunksize=1024)
+        elapsed = time.perf_counter() - start
+        print(f"  {processes:>2} processes {lines_count / elapsed:10.0f} transmissions/s")
+        if expected is None:
+            expected = results
+        elif results != expected:
+            raise Exception("The batch results depend on the number of processes")
+        if processes >= cores:
+            break
+        processes = min(processes * 2, cores)
+
+
+def check_tiny_sizes(seed=16):
+    # The generator must give a valid transmission even below the size of a
+    # single expression
+    encoder = BITS_Encoder()
+    for size_bits in range(0, 129, 4):
+        check_round_trip(encoder.generate(size_bits, seed=seed + size_bits))
+
+
+if __name__ == '__main__':
+    check_tiny_sizes()
+    sizes = [int(size) for size in sys.argv[1:]] or [1, 64, 1024, 16384]
+    for size in sizes:
+        benchmark(size)
+    benchmark_batch(100000)
@@ -149,6 +149,11 @@ Your puzzle answer was 10185143721112.
 Both parts of this puzzle are complete! They provide two gold stars: **
 '''
 
+import random
+from array import array
+from multiprocessing import Pool
+
+
 class BITS_Packet:
 
     LITERAL_TYPE = 4
@@ -169,7 +174,6 @@ class BITS_Packet:
         self.type_id       = None
 
         # used if the packet is a literal
-        self.literal_value_bin = ''
         self.literal_value = 0
 
         # Lenght ID if the packet is operator
@@ -184,6 +188,10 @@ class BITS_Packet:
         # internal subpackets for this packet
         self.sub_packets   = []
 
+        # value of the packet once get_value computed it, a packet is not
+        # changed after it is decoded and it can be shared by many operators
+        self.value_cache = None
+
     def subpackets_to_decode(self):
         # return True if there are subpackets that has not been decoded
         if self.lenght_subpacket_id == BITS_Packet.SUBPACKETS_LEN_IN_QUANTITY:
@@ -195,6 +203,28 @@ class BITS_Packet:
             # Version+Type+LenghtID+SUbpacketsSize
             return self.subpackets_len > self.size - (3+3+1+15)
 
+    @staticmethod
+    def combine_values(type_id, current, value):
+        # Add the value of a subpacket into the value of its operator, for the
+        # comparisons current is the value of the first subpacket
+        if current is None:
+            return value
+        if type_id == 0:
+            return current + value
+        elif type_id == 1:
+            return current * value
+        elif type_id == 2:
+            return value if value < current else current
+        elif type_id == 3:
+            return value if value > current else current
+        elif type_id == 5:
+            return 1 if current > value else 0
+        elif type_id == 6:
+            return 1 if current < value else 0
+        elif type_id == 7:
+            return 1 if current == value else 0
+        raise Exception(f"Invalid packet type {type_id}")
+
     def get_value(self):
         # Get final value of the packet and subpackets
         # TODO override __min__ __max__ __add__ __radd__ __eq__ __neq__ __lt__
@@ -204,6 +234,9 @@ class BITS_Packet:
             # literal type, return the value
             return self.literal_value
 
+        if self.value_cache is not None:
+            return self.value_cache
+
         if self.type_id == 0:
             # sum
             value = 0
@@ -240,139 +273,824 @@ class BITS_Packet:
             # equal to
             p1, p2 = self.sub_packets
             value = 1 if p1.get_value() == p2.get_value() else 0
+        self.value_cache = value
         return value
 
-class BITS_Transmission:
-    def __init__(self):
-        self.total_versions = 0
+class BITS_TruncatedError(Exception):
+    # The transmission ended before the packet being decoded
+    pass
+
+
+class BITS_Reader:
+    # Reads fields of any number of bits from a hex transmission. The hex is
+    # converted once into bytes and a cursor keeps the position of the next bit.
+    # The fields are read from a window of WINDOW_BYTES bytes kept as an integer,
+    # only loaded again when a field goes past it, so most reads are a shift
+    # and a mask
+
+    WINDOW_BYTES = 16
+
+    def __init__(self, transmission):
+        if len(transmission) % 2:
+            # bytes.fromhex needs full bytes, the extra 4 bits are padding
+            transmission += '0'
+        self.__data = bytes.fromhex(transmission)
+        self.__size = len(self.__data) * 8
+        self.position = 0
+
+        # the window holds window_bits bits from the bit window_start
+        self.__window = 0
+        self.__window_start = 0
+        self.__window_bits = 0
+
+    @property
+    def size(self):
+        return self.__size
+
+    def remaining(self):
+        return self.__size - self.position
+
+    def __load_window(self, bits):
+        # Load the window from the byte of position, with room for bits
+        end = self.position + bits
+        if end > self.__size:
+            raise BITS_TruncatedError(f"Transmission too short, {bits} bits needed at {self.position}")
+
+        first_byte = self.position >> 3
+        last_byte = max(first_byte + BITS_Reader.WINDOW_BYTES, (end + 7) >> 3)
+        window = self.__data[first_byte:last_byte]
+        self.__window = int.from_bytes(window, 'big')
+        self.__window_start = first_byte << 3
+        self.__window_bits = len(window) << 3
+
+    def read(self, bits):
+        # Return the next bits as an integer, most significant bit first
+        offset = self.position - self.__window_start
+        if offset < 0 or offset + bits > self.__window_bits:
+            self.__load_window(bits)
+            offset = self.position - self.__window_start
+        self.position += bits
+        return (self.__window >> (self.__window_bits - offset - bits)) & ((1 << bits) - 1)
+
+    def read_literal(self):
+        # The literal is in groups of 5 bits, the first bit of the group
+        # is 0 for the last group and the other 4 are part of the value
+        value = 0
+        group = 0b10000
+        while group & 0b10000:
+            offset = self.position - self.__window_start
+            if offset < 0 or offset + 5 > self.__window_bits:
+                self.__load_window(5)
+                offset = self.position - self.__window_start
+            self.position += 5
+            group = (self.__window >> (self.__window_bits - offset - 5)) & 0b11111
+            value = (value << 4) | (group & 0b1111)
+        return value
 
-    @staticmethod
-    def __hex_to_bin(hex):
-        # convert the hex into an integex
-        return bin(int(hex, 16))[2:].zfill(4)
+    def skip(self, bits):
+        if self.position + bits > self.__size:
+            raise BITS_TruncatedError(f"Transmission too short, {bits} bits needed at {self.position}")
+        self.position += bits
 
 
-    def decode_message(self, transmission):
-        transmission_list = []
-        for v in transmission:
-            transmission_list.append(v)
-        transmission_list.reverse()
-        p, _ = self.__decode_message(transmission_list, '')
-        return p
+class BITS_Writer:
+    # Writes fields of any number of bits, the inverse of BITS_Reader. Full
+    # bytes are moved from an integer accumulator into a bytearray. patch()
+    # overwrites a field already written, used for lengths only known later
 
-    def __decode_message(self, transmission, unused_bits):
-        # Decode a message and add all the packets into the self._packet
-        # transmission is the input transmission as a list in reverse order
+    def __init__(self):
+        self.__data = bytearray()
+        self.__pending = 0
+        self.__pending_bits = 0
+        self.position = 0
+
+    def write(self, value, bits):
+        self.__pending = (self.__pending << bits) | value
+        self.__pending_bits += bits
+        self.position += bits
+        if self.__pending_bits >= 64:
+            full_bytes, self.__pending_bits = divmod(self.__pending_bits, 8)
+            self.__data += (self.__pending >> self.__pending_bits).to_bytes(full_bytes, 'big')
+            self.__pending &= (1 << self.__pending_bits) - 1
+
+    def patch(self, position, value, bits):
+        # Overwrite the bits from position with value
+        written = len(self.__data) * 8
+        for i in range(bits):
+            bit = (value >> (bits - 1 - i)) & 1
+            bit_position = position + i
+            if bit_position < written:
+                mask = 0x80 >> (bit_position & 7)
+                if bit:
+                    self.__data[bit_position >> 3] |= mask
+                else:
+                    self.__data[bit_position >> 3] &= ~mask
+            else:
+                mask = 1 << (self.__pending_bits - 1 - (bit_position - written))
+                if bit:
+                    self.__pending |= mask
+                else:
+                    self.__pending &= ~mask
+
+    def hex(self):
+        # The transmission padded with 0 bits up to a full byte
+        padding = -self.__pending_bits % 8
+        tail = (self.__pending << padding).to_bytes((self.__pending_bits + padding) // 8, 'big')
+        return (bytes(self.__data) + tail).hex().upper()
 
-        # TODO use integers and bit operands instead of strings for better performance
-        # TODO add exception clauses in else statements
 
+class BITS_Transmission:
+    def __init__(self):
+        self.total_versions = 0
+
+        # Interning of identical packets, the key is the packet fields with the
+        # ids of its (already interned) subpackets and the value the shared packet
+        self.__interned = {}
+        self.__intern = False
+        self.decoded_packets = 0
+
+    def decode_message(self, transmission, intern=False):
+        # With intern, packets that are identical to a packet already decoded
+        # (same fields and same subpackets) are replaced by the first one. The
+        # result is a graph of shared packets, the value of each distinct packet
+        # is computed once. The interned packets and the statistics are only
+        # those of the last transmission
+        self.__intern = intern
+        self.__interned = {}
+        self.decoded_packets = 0
+        return self.__decode_message(BITS_Reader(transmission))
+
+    def distinct_packets(self):
+        return len(self.__interned)
+
+    def dedup_ratio(self):
+        # decoded packets for each distinct packet kept with intern, for the
+        # last transmission decoded
+        if not self.__interned:
+            return 1.0
+        return self.decoded_packets / len(self.__interned)
+
+    def __intern_packet(self, packet):
+        if not self.__intern:
+            return packet
+        self.decoded_packets += 1
+
+        key = (packet.version, packet.type_id, packet.literal_value,
+               packet.lenght_subpacket_id, packet.subpackets_len, packet.size,
+               tuple(id(p) for p in packet.sub_packets))
+        return self.__interned.setdefault(key, packet)
+
+    def __decode_message(self, reader):
+        # Decode the packet at the reader position and all its subpackets
         packet = BITS_Packet()
+        start = reader.position
+
+        # The first 3 bits are the version and the next 3 the type
+        header = reader.read(6)
+        packet.version = header >> 3
+        self.total_versions += packet.version
+        packet.type_id = header & 0b111
+
+        if packet.type_id == BITS_Packet.LITERAL_TYPE:
+            packet.literal_value = reader.read_literal()
+            packet.size = reader.position - start
+            return self.__intern_packet(packet)
+
+        # This is a operator packet, there are one or more subpackets
+        # Get the lentgh ID to know how to get the subtasks
+        lenght_id = reader.read(1)
+        packet.lenght_subpacket_id = BITS_Packet.LENTGH_ID_VALUES[lenght_id]
+        packet.subpackets_len = reader.read(packet.lenght_subpacket_id)
+        packet.size = reader.position - start
+
+        # Get all the subpackets of the current packet
+        while packet.subpackets_to_decode():
+            p = self.__decode_message(reader)
+            packet.sub_packets.append(p)
+            packet.size += p.size
+
+        return self.__intern_packet(packet)
+
+    def evaluate_message(self, transmission):
+        # Decode and evaluate the transmission in a single pass without building
+        # the packets. Each operator being decoded has a frame in an explicit
+        # stack, the memory used depends on the nesting depth and not on the
+        # number of packets. Return (sum of versions, value, number of packets)
+        reader = BITS_Reader(transmission)
+
+        # frame: [type_id, length in bits, end position or subpackets left, value]
+        stack = []
+        versions = 0
+        packets = 0
+        while True:
+            versions += reader.read(3)
+            packets += 1
+            type_id = reader.read(3)
+
+            if type_id == BITS_Packet.LITERAL_TYPE:
+                value = reader.read_literal()
+            else:
+                if reader.read(1) == 0:
+                    frame = [type_id, True, 0, None]
+                    frame[2] = reader.read(BITS_Packet.SUBPACKETS_LEN_IN_BITS) + reader.position
+                else:
+                    frame = [type_id, False, reader.read(BITS_Packet.SUBPACKETS_LEN_IN_QUANTITY), None]
+                stack.append(frame)
+                if not BITS_Transmission.__frame_done(frame, reader):
+                    # decode the first subpacket
+                    continue
+                stack.pop()
+                value = BITS_Transmission.__frame_value(frame)
+
+            # Give the value to the operator it belongs to, every operator with
+            # all its subpackets decoded gives its value to its parent
+            while stack:
+                frame = stack[-1]
+                frame[3] = BITS_Packet.combine_values(frame[0], frame[3], value)
+                if not frame[1]:
+                    frame[2] -= 1
+                if not BITS_Transmission.__frame_done(frame, reader):
+                    break
+                stack.pop()
+                value = BITS_Transmission.__frame_value(frame)
+            else:
+                self.total_versions += versions
+                return versions, value, packets
 
-        while transmission or unused_bits:
-            if transmission:
-                # transmission list can be over but there might still be some
-                # bits in the unused_bits
-                val_hex = transmission.pop()
+    @staticmethod
+    def decode_batch(transmissions, processes=None, chunksize=1024):
+        # Decode each transmission on its own, spread in chunks over a pool of
+        # processes. Return (sum of versions, value, number of packets) for each
+        # transmission in the same order
+        transmissions = list(transmissions)
+        if processes == 1 or len(transmissions) <= chunksize:
+            return [evaluate_transmission(t) for t in transmissions]
+
+        with Pool(processes) as pool:
+            return pool.map(evaluate_transmission, transmissions, chunksize)
 
-                # Get the hex value in bits, this is a single hex character
-                # the output is a value between 0-15
-                bin_value_str = BITS_Transmission.__hex_to_bin(val_hex)
+    @staticmethod
+    def __frame_done(frame, reader):
+        if frame[1]:
+            return reader.position >= frame[2]
+        return frame[2] <= 0
 
-                # Add the unused bits from the previous decoding
-                bin_value_str = unused_bits + bin_value_str
-                unused_bits = ''
+    @staticmethod
+    def __frame_value(frame):
+        if frame[3] is None:
+            raise Exception(f"Operator packet of type {frame[0]} without subpackets")
+        return frame[3]
+
+def evaluate_transmission(transmission):
+    # Worker of BITS_Transmission.decode_batch
+    return BITS_Transmission().evaluate_message(transmission)
+
+
+class BITS_PacketStore:
+    # Decoded transmission stored as parallel columns instead of one object per
+    # packet. The packets are in the order they appear in the transmission, the
+    # subpackets of an operator start right after it and each one follows the
+    # whole subtree of the previous one
+
+    NO_CHILD = 2**32 - 1
+
+    def __init__(self, transmission):
+        self.version = array('B')
+        self.type_id = array('B')
+        # literals that do not fit in 64 bits are kept in big_literals
+        self.literal = array('Q')
+        self.big_literals = {}
+        self.first_child = array('I')
+        self.child_count = array('I')
+        self.bit_size = array('Q')
+
+        self.__decode(BITS_Reader(transmission))
+
+    def __len__(self):
+        return len(self.version)
+
+    def __decode(self, reader):
+        # frame: [index, length in bits, end position or subpackets left, start position]
+        stack = []
+        while True:
+            index = len(self.version)
+            start = reader.position
+            self.version.append(reader.read(3))
+            type_id = reader.read(3)
+            self.type_id.append(type_id)
+            self.literal.append(0)
+            self.first_child.append(BITS_PacketStore.NO_CHILD)
+            self.child_count.append(0)
+            self.bit_size.append(0)
+
+            if stack:
+                parent = stack[-1][0]
+                if self.child_count[parent] == 0:
+                    self.first_child[parent] = index
+                self.child_count[parent] += 1
+
+            if type_id == BITS_Packet.LITERAL_TYPE:
+                value = reader.read_literal()
+                if value >> 64:
+                    self.big_literals[index] = value
+                else:
+                    self.literal[index] = value
+                self.bit_size[index] = reader.position - start
             else:
-                # no more bytes in the transmission, keep using the unused_bits
-                bin_value_str = unused_bits
-
-            if packet.version is None:
-                # Version is not defined. The first 3 bits represent the version
-                version = int(bin_value_str[:3], 2)
-                self.total_versions += version
-                packet.version = version
-                packet.size += 3
-
-                # Set the unused bits
-                unused_bits = bin_value_str[3:]
-            elif packet.type_id is None:
-                # Version was set but type has not been set
-                # The unsued bit | with the 2 bits of bin_value are used
-                type_id = int(bin_value_str[:3], 2)
-                packet.type_id = type_id
-                packet.size += 3
-
-                # Set the unused bits
-                unused_bits = bin_value_str[3:]
-            elif packet.type_id == BITS_Packet.LITERAL_TYPE:
-                # There are no subpackets
-                # Find the value of the literal and return teh packet
-
-                end_literal = int(bin_value_str[0], 2)
-
-                # This is the end of the literal
-                if len(bin_value_str) < 5:
-                    # not enouhg bits
-                    unused_bits = bin_value_str[0:]
+                if reader.read(1) == 0:
+                    frame = [index, True, 0, start]
+                    frame[2] = reader.read(BITS_Packet.SUBPACKETS_LEN_IN_BITS) + reader.position
+                else:
+                    frame = [index, False, reader.read(BITS_Packet.SUBPACKETS_LEN_IN_QUANTITY), start]
+                stack.append(frame)
+                if not BITS_PacketStore.__frame_done(frame, reader):
                     continue
+                stack.pop()
+                self.bit_size[index] = reader.position - start
+
+            # Close every operator with all its subpackets decoded
+            while stack:
+                frame = stack[-1]
+                if not frame[1]:
+                    frame[2] -= 1
+                if not BITS_PacketStore.__frame_done(frame, reader):
+                    break
+                stack.pop()
+                self.bit_size[frame[0]] = reader.position - frame[3]
+            else:
+                return
 
-                # Get the next 4 bits for the literal value
-                packet.literal_value_bin += bin_value_str[1:5]
-                unused_bits = bin_value_str[5:]
-                packet.size += 5
+    @staticmethod
+    def __frame_done(frame, reader):
+        if frame[1]:
+            return reader.position >= frame[2]
+        return frame[2] <= 0
+
+    def literal_value(self, index):
+        return self.big_literals.get(index, self.literal[index])
+
+    def version_sum(self):
+        return sum(self.version)
+
+    def type_histogram(self):
+        # number of packets of each type
+        return {type_id: self.type_id.count(type_id) for type_id in range(8)}
+
+    def literal_count(self):
+        return self.type_id.count(BITS_Packet.LITERAL_TYPE)
+
+    def max_depth(self):
+        # Depth of the deepest packet, the outermost packet has depth 1. Each
+        # open operator keeps in the stack how many subpackets are left
+        depth = 0
+        stack = []
+        for count in self.child_count:
+            while stack and stack[-1] == 0:
+                stack.pop()
+            if stack:
+                stack[-1] -= 1
+            stack.append(count)
+            if len(stack) > depth:
+                depth = len(stack)
+        return depth
+
+    def value(self):
+        # Evaluate the packets from the last one to the first, the values of the
+        # subpackets of an operator are then on top of the stack in their order
+        values = []
+        for index in range(len(self.version) - 1, -1, -1):
+            type_id = self.type_id[index]
+            if type_id == BITS_Packet.LITERAL_TYPE:
+                values.append(self.literal_value(index))
+                continue
+
+            value = None
+            for _ in range(self.child_count[index]):
+                value = BITS_Packet.combine_values(type_id, value, values.pop())
+            if value is None:
+                raise Exception(f"Operator packet of type {type_id} without subpackets")
+            values.append(value)
+        return values[0]
+
+
+class BITS_LazyEvaluator:
+    # Evaluate a transmission decoding only the subpackets needed for the value.
+    # Once the value of an operator is decided by the subpackets seen so far the
+    # rest are skipped: a product or a minimum that reached 0 (literals are never
+    # negative) and a greater than with a first subpacket of 0. Subpackets given
+    # by length in bits are jumped over without decoding them, the ones given by
+    # quantity are only walked to find where they end.
+    # If the transmission is cut after the value of the outermost packet is
+    # decided, the value is still returned
 
-                if end_literal == 0:
-                    # last 4 bits of the literal value
-                    packet.literal_value = int(packet.literal_value_bin, 2)
-                    return packet, unused_bits
+    def __init__(self):
+        # operators decided before all their subpackets were seen
+        self.short_circuits = 0
+        # direct subpackets of those operators that were skipped (quantity mode)
+        self.skipped_children = 0
+        # packets walked without evaluating them
+        self.skipped_packets = 0
+        # bits jumped over without decoding them (length in bits mode)
+        self.skipped_bits = 0
+        # packets decoded and evaluated
+        self.evaluated_packets = 0
+
+    def evaluate(self, transmission):
+        reader = BITS_Reader(transmission)
+
+        # frame: [type_id, length in bits, end position or subpackets left, value, decided]
+        stack = []
+        try:
+            while True:
+                reader.skip(3)
+                type_id = reader.read(3)
+                self.evaluated_packets += 1
+
+                if type_id == BITS_Packet.LITERAL_TYPE:
+                    value = reader.read_literal()
+                else:
+                    if reader.read(1) == 0:
+                        frame = [type_id, True, 0, None, False]
+                        frame[2] = reader.read(BITS_Packet.SUBPACKETS_LEN_IN_BITS) + reader.position
+                    else:
+                        frame = [type_id, False, reader.read(BITS_Packet.SUBPACKETS_LEN_IN_QUANTITY),
+                                 None, False]
+                    stack.append(frame)
+                    if not BITS_LazyEvaluator.__frame_done(frame, reader):
+                        continue
+                    stack.pop()
+                    if frame[3] is None:
+                        raise Exception(f"Operator packet of type {type_id} without subpackets")
+                    value = frame[3]
+
+                while stack:
+                    frame = stack[-1]
+                    first = frame[3] is None
+                    frame[3] = BITS_Packet.combine_values(frame[0], frame[3], value)
+                    if not frame[1]:
+                        frame[2] -= 1
+
+                    if ((frame[0] == 1 or frame[0] == 2) and frame[3] == 0) or \
+                            (frame[0] == 5 and first and value == 0):
+                        frame[3] = 0
+                        frame[4] = True
+                        self.__skip_rest(frame, reader)
+                    elif not BITS_LazyEvaluator.__frame_done(frame, reader):
+                        break
+                    stack.pop()
+                    value = frame[3]
+                else:
+                    return value
+        except BITS_TruncatedError:
+            if stack and stack[0][4]:
+                # the outermost packet was decided before the transmission ended
+                return stack[0][3]
+            raise
+
+    def __skip_rest(self, frame, reader):
+        # Skip the subpackets of a decided operator, decided on its last
+        # subpacket there is nothing left to skip and it is no short circuit
+        if BITS_LazyEvaluator.__frame_done(frame, reader):
+            return
+        self.short_circuits += 1
+        if frame[1]:
+            bits = frame[2] - reader.position
+            self.skipped_bits += bits
+            reader.skip(bits)
+        else:
+            self.skipped_children += frame[2]
+            while frame[2] > 0:
+                self.__skip_packet(reader)
+                frame[2] -= 1
+
+    def __skip_packet(self, reader):
+        # Walk over one packet and its subpackets, pending keeps how many
+        # packets are left in each operator given by quantity
+        pending = [1]
+        while pending:
+            if pending[-1] == 0:
+                pending.pop()
+                continue
+            pending[-1] -= 1
+
+            reader.skip(3)
+            type_id = reader.read(3)
+            self.skipped_packets += 1
+            if type_id == BITS_Packet.LITERAL_TYPE:
+                while reader.read(5) & 0b10000:
+                    pass
+            elif reader.read(1) == 0:
+                bits = reader.read(BITS_Packet.SUBPACKETS_LEN_IN_BITS)
+                self.skipped_bits += bits
+                reader.skip(bits)
+            else:
+                pending.append(reader.read(BITS_Packet.SUBPACKETS_LEN_IN_QUANTITY))
 
-            elif packet.type_id != BITS_Packet.LITERAL_TYPE:
-                # This is a operator packet, there are one or more
-                # subpackets
+    @staticmethod
+    def __frame_done(frame, reader):
+        if frame[1]:
+            return reader.position >= frame[2]
+        return frame[2] <= 0
 
-                # Get the lentgh ID to know how to get the subtasks
 
-                if packet.lenght_subpacket_id is None:
-                    # the lenght_id is a single bit
-                    lenght_id = int(bin_value_str[0], 2)
-                    packet.size += 1
-                    bin_value_str = bin_value_str[1:]
-                    packet.lenght_subpacket_id = BITS_Packet.LENTGH_ID_VALUES[lenght_id]
+class BITS_Encoder:
+    # Encode packets back into a hex transmission and generate random valid
+    # transmissions to test and benchmark the decoders
 
-                if len(bin_value_str) < packet.lenght_subpacket_id:
-                    # Still not big enough
-                    unused_bits = bin_value_str[0:]
-                    continue
+    # operator types, literals are generated at the bottom of the tree
+    OPERATOR_TYPES = (0, 1, 2, 3, 5, 6, 7)
 
-                # There are enough bits to read the subpackets
-                packet.subpackets_len = int(bin_value_str[:packet.lenght_subpacket_id], 2)
-                unused_bits = bin_value_str[packet.lenght_subpacket_id:]
-                packet.size += packet.lenght_subpacket_id
+    def __init__(self):
+        self.__writer = None
+
+    def encode(self, packet):
+        # Encode a packet tree. Each packet keeps its length type, packets without
+        # one (built by hand) use the length in bits
+        self.__writer = BITS_Writer()
+
+        # frame: [packet, next subpacket, position of the length in bits or None]
+        stack = []
+        frame = self.__open(packet)
+        if frame:
+            stack.append(frame)
+        while stack:
+            frame = stack[-1]
+            if frame[1] < len(frame[0].sub_packets):
+                child = frame[0].sub_packets[frame[1]]
+                frame[1] += 1
+                child_frame = self.__open(child)
+                if child_frame:
+                    stack.append(child_frame)
+            else:
+                self.__close(frame[2])
+                stack.pop()
+
+        return self.__writer.hex()
+
+    def __open(self, packet):
+        # Write the packet up to its subpackets, return its frame if it is an operator
+        self.__write_header(packet.version, packet.type_id)
+        if packet.type_id == BITS_Packet.LITERAL_TYPE:
+            self.__write_literal(packet.literal_value)
+            return None
+
+        by_quantity = packet.lenght_subpacket_id == BITS_Packet.SUBPACKETS_LEN_IN_QUANTITY
+        return [packet, 0, self.__write_length(by_quantity, len(packet.sub_packets))]
+
+    def __write_header(self, version, type_id):
+        self.__writer.write(version, 3)
+        self.__writer.write(type_id, 3)
+
+    def __write_literal(self, value):
+        groups = max(1, (value.bit_length() + 3) // 4)
+        for group in range(groups - 1, -1, -1):
+            last = 0 if group == 0 else 0b10000
+            self.__writer.write(last | ((value >> (group * 4)) & 0b1111), 5)
+
+    def __write_length(self, by_quantity, subpackets):
+        # Write the length type and length, the length in bits is written as 0
+        # and its position returned so __close can patch it
+        if by_quantity:
+            if subpackets >= 1 << BITS_Packet.SUBPACKETS_LEN_IN_QUANTITY:
+                raise Exception(f"Too many subpackets {subpackets}")
+            self.__writer.write(1, 1)
+            self.__writer.write(subpackets, BITS_Packet.SUBPACKETS_LEN_IN_QUANTITY)
+            return None
+
+        self.__writer.write(0, 1)
+        position = self.__writer.position
+        self.__writer.write(0, BITS_Packet.SUBPACKETS_LEN_IN_BITS)
+        return position
+
+    def __close(self, length_position):
+        if length_position is None:
+            return
+        bits = self.__writer.position - length_position - BITS_Packet.SUBPACKETS_LEN_IN_BITS
+        if bits >= 1 << BITS_Packet.SUBPACKETS_LEN_IN_BITS:
+            raise Exception(f"Subpackets too long for their length in bits {bits}")
+        self.__writer.patch(length_position, bits, BITS_Packet.SUBPACKETS_LEN_IN_BITS)
+
+    def generate(self, size_bits, seed=0, depth=6, fan_out=4, literal_bits=16,
+                 bits_length_ratio=0.5):
+        # Random transmission of at least size_bits bits. The outermost packet is a
+        # sum of up to 2047 sums of up to 2047 random expressions each, so it can
+        # grow to hundreds of MB. Each expression has at most depth levels of
+        # operators with 1 to fan_out subpackets (2 for comparisons), literals of
+        # literal_bits bits, and uses the length in bits with the probability
+        # bits_length_ratio when its subpackets surely fit in 15 bits of length
+        rng = random.Random(seed)
+        self.__writer = BITS_Writer()
+        max_children = (1 << BITS_Packet.SUBPACKETS_LEN_IN_QUANTITY) - 1
+
+        # largest size in bits of an expression with each number of levels
+        literal_size = 6 + 5 * max(1, (literal_bits + 3) // 4)
+        max_size = [literal_size]
+        for _ in range(depth):
+            max_size.append(6 + 1 + 15 + max(fan_out, 2) * max_size[-1])
+
+        self.__write_header(rng.getrandbits(3), 0)
+        blocks_position = self.__writer.position + 1
+        self.__write_length(True, 0)
+        # every sum needs a subpacket, so there is always at least one block
+        # and one expression in each block, however small size_bits is
+        blocks = 0
+        while True:
+            self.__write_header(rng.getrandbits(3), 0)
+            expressions_position = self.__writer.position + 1
+            self.__write_length(True, 0)
+            expressions = 0
+            while True:
+                self.__generate_expression(rng, depth, fan_out, literal_bits,
+                                           bits_length_ratio, max_size)
+                expressions += 1
+                if self.__writer.position >= size_bits or expressions == max_children:
+                    break
+            self.__writer.patch(expressions_position, expressions,
+                                BITS_Packet.SUBPACKETS_LEN_IN_QUANTITY)
+            blocks += 1
+            if self.__writer.position >= size_bits or blocks == max_children:
+                break
+        self.__writer.patch(blocks_position, blocks, BITS_Packet.SUBPACKETS_LEN_IN_QUANTITY)
+
+        return self.__writer.hex()
+
+    def __generate_expression(self, rng, depth, fan_out, literal_bits, bits_length_ratio,
+                              max_size):
+        # frame: [subpackets left, position of the length in bits or None]
+        stack = []
+        while True:
+            levels = depth - len(stack)
+            if levels == 0 or rng.random() < 0.2:
+                self.__write_header(rng.getrandbits(3), BITS_Packet.LITERAL_TYPE)
+                self.__write_literal(rng.getrandbits(literal_bits))
+            else:
+                type_id = rng.choice(BITS_Encoder.OPERATOR_TYPES)
+                children = 2 if type_id >= 5 else rng.randint(1, fan_out)
+                by_quantity = max_size[levels] >= 1 << BITS_Packet.SUBPACKETS_LEN_IN_BITS or \
+                    rng.random() >= bits_length_ratio
+                self.__write_header(rng.getrandbits(3), type_id)
+                stack.append([children, self.__write_length(by_quantity, children)])
+                continue
+
+            # close the operators with all their subpackets written
+            while stack:
+                stack[-1][0] -= 1
+                if stack[-1][0] > 0:
+                    break
+                self.__close(stack.pop()[1])
+            else:
+                return
 
 
-                # Get all the subpackets of the current packet
-                while packet.subpackets_to_decode():
-                    p, u = self.__decode_message(transmission, unused_bits)
-                    packet.sub_packets.append(p)
-                    packet.size += p.size
-                    unused_bits = u
+class BITS_StreamDecoder:
+    # Push decoder, the transmission is given in chunks of hex with feed() and
+    # the packets are decoded as soon as their bits arrive. Each feed returns
+    # the events of the packets decoded so far:
+    #   ('start', version, type_id)   an operator packet begins
+    #   ('literal', version, value)   a literal packet
+    #   ('end', type_id, value)       an operator packet and all its subpackets end
+    # Only the hex of the field being decoded and one frame per open operator are
+    # kept between chunks
 
-                # Return after all subpackets are added
-                return packet, unused_bits
+    HEADER = 0
+    LITERAL = 1
+    LENGTH_ID = 2
+    LENGTH = 3
+    DONE = 4
 
+    def __init__(self):
+        self.total_versions = 0
+        self.value = None
+
+        self.__state = BITS_StreamDecoder.HEADER
+        # frame: [type_id, length in bits, end position or subpackets left, value]
+        self.__stack = []
+        self.__version = None
+        self.__type_id = None
+        self.__literal = 0
+        self.__length_bits = None
+
+        # hex not decoded yet, the first bit_offset bits are already used.
+        # base is the position in the transmission of the first bit of pending
+        self.__pending = ''
+        self.__bit_offset = 0
+        self.__base = 0
+
+    def __bits_needed(self):
+        if self.__state == BITS_StreamDecoder.HEADER:
+            return 6
+        elif self.__state == BITS_StreamDecoder.LITERAL:
+            return 5
+        elif self.__state == BITS_StreamDecoder.LENGTH_ID:
+            return 1
+        elif self.__state == BITS_StreamDecoder.LENGTH:
+            return self.__length_bits
+        return None
+
+    def feed(self, chunk):
+        events = []
+        if self.__state == BITS_StreamDecoder.DONE:
+            # the rest of the transmission is padding
+            return events
+
+        data = self.__pending + ''.join(chunk.split())
+        reader = BITS_Reader(data)
+        reader.position = self.__bit_offset
+        available = len(data) * 4
+
+        needed = self.__bits_needed()
+        while needed is not None and available - reader.position >= needed:
+            self.__decode_field(reader.read(needed), self.__base + reader.position, events)
+            needed = self.__bits_needed()
+
+        # keep the hex from the nibble with the next bit
+        used_hex = reader.position // 4
+        self.__pending = data[used_hex:] if needed is not None else ''
+        self.__bit_offset = reader.position % 4
+        self.__base += used_hex * 4
+        return events
+
+    def close(self):
+        # The transmission is over, it must have ended after a full packet
+        if self.__state != BITS_StreamDecoder.DONE:
+            raise Exception("Transmission ended in the middle of a packet")
+        return self.value
+
+    def __decode_field(self, field, position, events):
+        # Move the state machine with the field just read, position is the
+        # position in the transmission right after the field
+        if self.__state == BITS_StreamDecoder.HEADER:
+            self.__version = field >> 3
+            self.__type_id = field & 0b111
+            self.total_versions += self.__version
+            if self.__type_id == BITS_Packet.LITERAL_TYPE:
+                self.__literal = 0
+                self.__state = BITS_StreamDecoder.LITERAL
+            else:
+                self.__state = BITS_StreamDecoder.LENGTH_ID
+
+        elif self.__state == BITS_StreamDecoder.LITERAL:
+            self.__literal = (self.__literal << 4) | (field & 0b1111)
+            if not field & 0b10000:
+                # last group of the literal
+                events.append(('literal', self.__version, self.__literal))
+                self.__packet_done(self.__literal, position, events)
+
+        elif self.__state == BITS_StreamDecoder.LENGTH_ID:
+            self.__length_bits = BITS_Packet.LENTGH_ID_VALUES[field]
+            self.__state = BITS_StreamDecoder.LENGTH
+
+        elif self.__state == BITS_StreamDecoder.LENGTH:
+            events.append(('start', self.__version, self.__type_id))
+            if self.__length_bits == BITS_Packet.SUBPACKETS_LEN_IN_BITS:
+                frame = [self.__type_id, True, position + field, None]
+            else:
+                frame = [self.__type_id, False, field, None]
+            self.__stack.append(frame)
+            self.__state = BITS_StreamDecoder.HEADER
+            if BITS_StreamDecoder.__frame_done(frame, position):
+                # operator without subpackets, it has no value
+                self.__stack.pop()
+                value = BITS_StreamDecoder.__frame_value(frame)
+                events.append(('end', frame[0], value))
+                self.__packet_done(value, position, events)
+
+    def __packet_done(self, value, position, events):
+        # A packet is complete, give its value to its operator and close every
+        # operator that has all its subpackets
+        while self.__stack:
+            frame = self.__stack[-1]
+            frame[3] = BITS_Packet.combine_values(frame[0], frame[3], value)
+            if not frame[1]:
+                frame[2] -= 1
+            if not BITS_StreamDecoder.__frame_done(frame, position):
+                self.__state = BITS_StreamDecoder.HEADER
+                return
+            self.__stack.pop()
+            value = BITS_StreamDecoder.__frame_value(frame)
+            events.append(('end', frame[0], value))
+
+        self.value = value
+        self.__state = BITS_StreamDecoder.DONE
 
-        return packet, unused_bits
+    @staticmethod
+    def __frame_done(frame, position):
+        if frame[1]:
+            return position >= frame[2]
+        return frame[2] <= 0
 
+    @staticmethod
+    def __frame_value(frame):
+        if frame[3] is None:
+            raise Exception(f"Operator packet of type {frame[0]} without subpackets")
+        return frame[3]
 
-transmission = BITS_Transmission()
 
-with open('input_data.txt', 'r') as f:
-    line = f.readline()
-    while line:
-        line = line.strip()
-        # message is a single line
-        packet = transmission.decode_message(line)
-        line = f.readline()
+if __name__ == '__main__':
+    # each line is a different transmission
+    with open('input_data.txt', 'r') as f:
+        lines = [line.strip() for line in f if line.strip()]
 
-print(f"Sum of all versions {transmission.total_versions}")
-print(f"Value of the packet {packet.get_value()}")
+    for versions, value, _ in BITS_Transmission.decode_batch(lines):
+        print(f"Sum of all versions {versions}")
+        print(f"Value of the packet {value}")
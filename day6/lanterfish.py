@@ -82,17 +82,159 @@ Your puzzle answer was 1609314870967.
 
 '''
 
-with open('input_data.txt', 'r') as f:
-    lines = f.readlines()
-
-lantern_fish_ages = lines[0].split(',')
+import json
+import os
 
 # TODO move this into a class object
 previous_lanternfish = {}
 
+class LanternfishSpecies:
+    # How a species of lanternfish reproduces: every cycle days a fish creates
+    # litter new fish with a timer of newborn_timer. The lanternfish of the
+    # puzzle have a cycle of 7, newborn timer of 8 and a litter of 1.
+    #
+    # The powers M^(2^k) of the matrix of one day are kept on disk in cache_dir,
+    # one JSON file for each species and modulus, so forecasts for the same
+    # species do not compute them again after the process restarts. The numbers
+    # are written as hex strings, JSON decimal integers are limited in size.
+    #
+    # Exact powers grow fast, the numbers of M^(2^k) have about 2^k / 8 bits for
+    # the puzzle species, and the whole file is written again each time a
+    # higher power is added. Only the powers with numbers of at most
+    # max_cached_bits bits are written, with the default 4096 bits a file stays
+    # below 200 KB for every forecast (M^(2^15), about 32000 days exact, or any
+    # number of days with a modulus below 2^4096). Higher powers are only kept
+    # in memory. cache_dir=None keeps everything in memory
+
+    CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.lanternfish_cache')
+    MAX_CACHED_BITS = 4096
+
+    # species used when none is given, shared so its powers are loaded once
+    __default = None
+
+    def __init__(self, cycle=7, newborn_timer=8, litter=1, cache_dir=CACHE_DIR,
+                 max_cached_bits=MAX_CACHED_BITS):
+        if cycle < 1 or newborn_timer < 0 or litter < 0:
+            raise Exception(f"Invalid species {cycle}-{newborn_timer}-{litter}")
+        self.cycle = cycle
+        self.newborn_timer = newborn_timer
+        self.litter = litter
+        self.cache_dir = cache_dir
+        self.max_cached_bits = max_cached_bits
+
+        # number of timer values, from 0 to the largest timer a fish can have
+        self.timers = max(cycle, newborn_timer + 1)
+
+        # powers of the day matrix by modulus, the list index is k for M^(2^k)
+        self.__powers = {}
+
+    @staticmethod
+    def default():
+        if LanternfishSpecies.__default is None:
+            LanternfishSpecies.__default = LanternfishSpecies()
+        return LanternfishSpecies.__default
+
+    def key(self, modulus=None):
+        return f"{self.cycle}-{self.newborn_timer}-{self.litter}-{modulus or 'exact'}"
+
+    def day_matrix(self):
+        # matrix[new timer][old timer] = fish with the new timer for each old one
+        matrix = [[0] * self.timers for _ in range(self.timers)]
+        for timer in range(1, self.timers):
+            matrix[timer-1][timer] = 1
+        matrix[self.cycle-1][0] += 1
+        matrix[self.newborn_timer][0] += self.litter
+        return matrix
+
+    @staticmethod
+    def multiply(a, b, modulus=None):
+        size = len(a)
+        result = [[0] * size for _ in range(size)]
+        for i in range(size):
+            row = result[i]
+            for k, value in enumerate(a[i]):
+                if value:
+                    for j, other in enumerate(b[k]):
+                        row[j] += value * other
+            if modulus:
+                result[i] = [v % modulus for v in row]
+        return result
+
+    def power(self, k, modulus=None):
+        # M^(2^k), from the cache if it was computed before
+        powers = self.__load_powers(modulus)
+        if len(powers) <= k:
+            cached = self.__cacheable(powers)
+            if not powers:
+                powers.append(self.day_matrix())
+            while len(powers) <= k:
+                powers.append(LanternfishSpecies.multiply(powers[-1], powers[-1], modulus))
+            if self.__cacheable(powers) > cached:
+                self.__save_powers(modulus, powers[:self.__cacheable(powers)])
+        return powers[k]
+
+    def __cacheable(self, powers):
+        # Number of powers from the first one small enough to be written
+        count = 0
+        for matrix in powers:
+            if max(max(row) for row in matrix).bit_length() > self.max_cached_bits:
+                break
+            count += 1
+        return count
+
+    def __cache_file(self, modulus):
+        return os.path.join(self.cache_dir, self.key(modulus) + '.json')
+
+    def __load_powers(self, modulus):
+        if modulus not in self.__powers:
+            self.__powers[modulus] = []
+            if self.cache_dir and os.path.exists(self.__cache_file(modulus)):
+                try:
+                    with open(self.__cache_file(modulus), 'r') as f:
+                        powers = [[[int(value, 16) for value in row] for row in matrix]
+                                  for matrix in json.load(f)]
+                except (OSError, ValueError, TypeError):
+                    powers = None
+                # a broken cache file is ignored and the powers computed again
+                if self.__valid_powers(powers, modulus):
+                    self.__powers[modulus] = powers
+        return self.__powers[modulus]
+
+    def __valid_powers(self, powers, modulus):
+        # The powers must be timers x timers matrices of integers, starting
+        # with the matrix of one day of this species
+        if not isinstance(powers, list) or not powers or powers[0] != self.day_matrix():
+            return False
+        for matrix in powers:
+            if not isinstance(matrix, list) or len(matrix) != self.timers:
+                return False
+            for row in matrix:
+                if not isinstance(row, list) or len(row) != self.timers:
+                    return False
+                for value in row:
+                    if type(value) is not int or value < 0 or (modulus and value >= modulus):
+                        return False
+        return True
+
+    def __save_powers(self, modulus, powers):
+        if not self.cache_dir:
+            return
+        # write to a temporary file first so a crash never leaves a half file,
+        # without a writable cache directory the powers just stay in memory
+        temporary = self.__cache_file(modulus) + f".{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(temporary, 'w') as f:
+                json.dump([[[format(value, 'x') for value in row] for row in matrix]
+                           for matrix in powers], f)
+            os.replace(temporary, self.__cache_file(modulus))
+        except OSError:
+            pass
+
 class Lanternfish:
-    def __init__(self, age):
+    def __init__(self, age, species=None):
         self.age = age
+        self.species = species or LanternfishSpecies.default()
 
     # simulate the days and returns the number of days the fish would
     # have spaws and how many times eahc kid would have spawn
@@ -103,62 +245,177 @@ class Lanternfish:
             # Not enought days for a spawn
             return 0
 
+        cycle = self.species.cycle
+        litter = self.species.litter
+
         # Age is the number of days until the first spawn
         spawns = 1
         days -= (self.age+1)
 
         # Increase the number of spawn based on the total days for the original fish
-        spawns += int(days/7)
+        spawns += int(days/cycle)
 
         # There is a small set of combinations of spawns+days
         # No need to recalculate over and over again the same combinations
         # Store past combinations to keep it with better performance O(spawns+days)
-        spawns_days = str(spawns) +"-"+ str(days)
+        spawns_days = self.species.key() + "-" + str(spawns) +"-"+ str(days)
 
         if spawns_days not in previous_lanternfish:
+            kids = spawns * litter
             for i in range(spawns):
-                spawns += Lanternfish(8).simulate(days-i*7)
-            previous_lanternfish[spawns_days] = spawns
-            return spawns
+                kids += litter * Lanternfish(self.species.newborn_timer, self.species).simulate(days-i*cycle)
+            previous_lanternfish[spawns_days] = kids
+            return kids
         else:
             return previous_lanternfish[spawns_days]
 
-        return spawns
-
 class LanternfishSchool:
-    def __init__(self):
-        self.school = []
+    # Size of the blocks read from the input file
+    READ_SIZE = 1 << 20
+
+    def __init__(self, species=None):
+        self.species = species or LanternfishSpecies.default()
+
+        # Number of fish for each timer value, fish with the same timer behave
+        # the same way so there is no need to keep them one by one
+        self.histogram = [0] * self.species.timers
 
     # Add a lanternfish into the school
     def add(self, lanternfish):
         if not isinstance(lanternfish, Lanternfish):
             raise Exception("Input lanternfish is not a Lanternfish")
-        self.school.append(lanternfish)
+        if not 0 <= lanternfish.age < self.species.timers:
+            raise Exception(f"Invalid lanternfish age {lanternfish.age}")
+        self.histogram[lanternfish.age] += 1
+
+    def load(self, file_name):
+        # Add the fish of a file with comma separated ages. The ages are single
+        # digits so the fish of each age are counted in whole blocks of the file
+        # with str.count, no list with one element per fish is built. Without
+        # the whitespace the file must alternate one digit and one comma, the
+        # digits are turned into 'd' and the blocks checked for 'dd' and ',,'
+        if self.species.timers > 10:
+            raise Exception("Only ages of a single digit can be loaded")
+        timers = [str(timer) for timer in range(self.species.timers)]
+        invalid = str.maketrans('', '', ''.join(timers) + ', \n\r\t')
+        shape = str.maketrans({**{digit: 'd' for digit in timers},
+                               **{space: None for space in ' \n\r\t'}})
+        fields = ''
+        last_field = ''
+        with open(file_name, 'r') as f:
+            block = f.read(LanternfishSchool.READ_SIZE)
+            while block:
+                if block.translate(invalid):
+                    raise Exception(f"Invalid lanternfish ages {block.translate(invalid)[:10]!r}")
+
+                # the last field of the previous block joins the first of this
+                # one, with nothing before the file can not start with a comma
+                fields = (fields[-1:] or ',') + block.translate(shape)
+                if len(fields) > 1:
+                    last_field = fields[-1]
+                if 'dd' in fields:
+                    # two digits together, an age above the largest timer
+                    raise Exception(f"Invalid lanternfish ages, they must be between 0 and {self.species.timers-1}")
+                if ',,' in fields:
+                    raise Exception("Invalid lanternfish ages, empty age before a comma")
+
+                for timer, digit in enumerate(timers):
+                    self.histogram[timer] += block.count(digit)
+                block = f.read(LanternfishSchool.READ_SIZE)
+
+        if last_field == ',':
+            raise Exception("Invalid lanternfish ages, empty age after the last comma")
 
     def school_size(self):
-        return len(self.school)
+        return sum(self.histogram)
 
     def simulate_days(self, days):
-        size = self.school_size()
-
-        # Keep the past sizes in a dict to improve performance.
-        # There are only 6 possible 6 possible sizes, no need to recalculate the same
-        # size for the same giving of days
-        past_sizes = {}
-        for i, l in enumerate(self.school):
-            if l.age not in past_sizes:
-                _size = l.simulate(days)
-                past_sizes[l.age] = _size
-                size += _size
-            else:
-                size += past_sizes[l.age]
+        size = LanternfishPopulation(self.histogram, species=self.species).population(days)
         print(f"After {days} days the size of the school is {size}")
 
-lanternfish_school = LanternfishSchool()
-for age in lantern_fish_ages:
-    lanternfish_school.add(Lanternfish(int(age)))
-
-
-lanternfish_school.simulate_days(80)
-lanternfish_school.simulate_days(256)
+class LanternfishPopulation:
+    # The school is a vector with the number of fish for each timer value.
+    # One day is a linear function of that vector, for the default species:
+    #   the fish with timer t > 0 move to t-1
+    #   the fish with timer 0 move to 6 and each one adds a new fish with timer 8
+    # so after n days the vector is M^n * vector, with M the 9x9 matrix of one day.
+    # n is split in powers of 2 and the vector is multiplied by the M^(2^k) of
+    # each bit set, in O(log n) products. The powers come from the species cache.
+    # With a modulus all the numbers are kept modulo it, for when only
+    # population mod p is needed
+
+    def __init__(self, histogram, modulus=None, species=None):
+        self.species = species or LanternfishSpecies.default()
+        if len(histogram) != self.species.timers:
+            raise Exception(f"The histogram needs {self.species.timers} timers")
+        self.histogram = list(histogram)
+        self.modulus = modulus
+
+    def day_matrix(self):
+        return self.species.day_matrix()
+
+    def population(self, days):
+        # Number of fish after the given days, modulo the modulus if there is one
+        if days < 0:
+            raise Exception("Days can not be negative")
+
+        vector = self.histogram
+        k = 0
+        while days:
+            if days & 1:
+                power = self.species.power(k, self.modulus)
+                vector = [sum(value * count for value, count in zip(row, vector))
+                          for row in power]
+                if self.modulus:
+                    vector = [v % self.modulus for v in vector]
+            days >>= 1
+            k += 1
+
+        size = sum(vector)
+        return size % self.modulus if self.modulus else size
+
+    @staticmethod
+    def population_table(horizons, histograms, modulus=None, species=None):
+        # Population after each number of days in horizons for each school in
+        # histograms, as table[school][horizon]. All of them come from a single
+        # pass over the days: the population after n days of a school is
+        # sum(fish[t] * descendants[t]), where descendants[t] is the population
+        # after n days of a single fish with timer t. One more day turns
+        # descendants[t] into descendants[t-1] of the previous day, and for
+        # t = 0 the fish becomes a fish with timer cycle-1 and its litter
+        species = species or LanternfishSpecies.default()
+        for histogram in histograms:
+            if len(histogram) != species.timers:
+                raise Exception(f"The histogram needs {species.timers} timers")
+        if any(days < 0 for days in horizons):
+            raise Exception("Days can not be negative")
+
+        # descendants after each horizon, computed in order of days
+        at_horizon = {}
+        descendants = [1] * species.timers
+        day = 0
+        for days in sorted(set(horizons)):
+            while day < days:
+                zero = descendants[species.cycle-1] + species.litter * descendants[species.newborn_timer]
+                if modulus:
+                    zero %= modulus
+                descendants = [zero] + descendants[:-1]
+                day += 1
+            at_horizon[days] = descendants
+
+        table = []
+        for histogram in histograms:
+            row = []
+            for days in horizons:
+                size = sum(count * d for count, d in zip(histogram, at_horizon[days]))
+                row.append(size % modulus if modulus else size)
+            table.append(row)
+        return table
+
+if __name__ == '__main__':
+    lanternfish_school = LanternfishSchool()
+    lanternfish_school.load('input_data.txt')
+
+    lanternfish_school.simulate_days(80)
+    lanternfish_school.simulate_days(256)
 